@@ -4,22 +4,143 @@ Created on 13 nov. 2018
 @author: QFAURE
 '''
 import os
+import re
+import codecs
+import time
+import sqlite3
+import threading
 import logging
 import requests #sudo pip install requests
 import json
 from pathlib import Path
 from properties.p import Property
-from typing import Iterable
+from typing import Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from array import array
+from contextlib import closing
 
 
 logging.basicConfig(filename='RestClient.log', level=logging.DEBUG, format='%(asctime)s %(levelname)-8s %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
 url = os.environ['BMAP_BACKEND_URL'] + 'catalogue/granule/'
+# number of granules fetched at once from the catalogue
+workers = int(os.environ.get('BMAP_CATALOGUE_WORKERS', '8'))
+# the connections to the catalogue are kept open and shared by all the requests
+session = requests.Session()
+session.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=workers))
+session.mount('https://', requests.adapters.HTTPAdapter(pool_maxsize=workers))
+# size of the blocks written to disk while a file is downloaded
+chunk_size = 1024 * 1024
+
+
+class GranuleCache:
+    def __init__(self, max_size: int=1024, ttl: float=3600, path: str='', table: str='granule'):
+        """
+        Granule metadata by name, the least recently used are dropped past max_size and
+        all of them expire after ttl seconds (0 disables the cache). With a path, the
+        granules are also kept in the table of a SQLite file shared by the kernels"""
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = path
+        self.table = table
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if self.path and self.ttl > 0:
+            with closing(sqlite3.connect(self.path, timeout=30)) as db, db:
+                db.execute('CREATE TABLE IF NOT EXISTS ' + self.table + ' (name TEXT PRIMARY KEY, expires REAL, json TEXT)')
+            self.prune()
+
+    # returns the json of a granule, or None when it is not cached or expired
+    def get(self, name: str):
+        if self.ttl <= 0:
+            return None
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(name)
+            if entry and entry[0] > now:
+                self.entries.move_to_end(name)
+                self.hits += 1
+                return entry[1]
+            self.entries.pop(name, None)
+        if self.path:
+            with closing(sqlite3.connect(self.path, timeout=30)) as db:
+                row = db.execute('SELECT expires, json FROM ' + self.table + ' WHERE name = ?', (name,)).fetchone()
+            if row and row[0] > now:
+                self.remember(name, row[0], row[1])
+                with self.lock:
+                    self.hits += 1
+                return row[1]
+            if row:
+                self.prune()
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, name: str, json_str: str):
+        if self.ttl <= 0:
+            return
+        expires = time.time() + self.ttl
+        self.remember(name, expires, json_str)
+        if self.path:
+            with closing(sqlite3.connect(self.path, timeout=30)) as db, db:
+                db.execute('INSERT OR REPLACE INTO ' + self.table + ' VALUES (?, ?, ?)', (name, expires, json_str))
+
+    # deletes the expired granules of the SQLite file
+    def prune(self):
+        with closing(sqlite3.connect(self.path, timeout=30)) as db, db:
+            db.execute('DELETE FROM ' + self.table + ' WHERE expires <= ?', (time.time(),))
+
+    def remember(self, name: str, expires: float, json_str: str):
+        with self.lock:
+            self.entries[name] = (expires, json_str)
+            self.entries.move_to_end(name)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    # forgets one granule, or all of them without a name
+    def invalidate(self, name: str=None):
+        with self.lock:
+            if name is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(name, None)
+        if self.path and self.ttl > 0:
+            with closing(sqlite3.connect(self.path, timeout=30)) as db, db:
+                if name is None:
+                    db.execute('DELETE FROM ' + self.table)
+                else:
+                    db.execute('DELETE FROM ' + self.table + ' WHERE name = ?', (name,))
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self.entries)}
+
+
+# granules already fetched, see GranuleCache for the settings
+granule_cache = GranuleCache(int(os.environ.get('BMAP_CATALOGUE_CACHE_SIZE', '1024')),
+                             float(os.environ.get('BMAP_CATALOGUE_CACHE_TTL', '3600')),
+                             os.environ.get('BMAP_CATALOGUE_CACHE_FILE', ''))
+# granules found by criteria, by canonical criteria, in their own table of the same file.
+# Disabled unless BMAP_CATALOGUE_SEARCH_CACHE_TTL is set, searches finding more than
+# search_cache_max_granules granules are not cached
+search_cache = GranuleCache(int(os.environ.get('BMAP_CATALOGUE_SEARCH_CACHE_SIZE', '64')),
+                            float(os.environ.get('BMAP_CATALOGUE_SEARCH_CACHE_TTL', '0')),
+                            os.environ.get('BMAP_CATALOGUE_CACHE_FILE', ''), 'search')
+search_cache_max_granules = int(os.environ.get('BMAP_CATALOGUE_SEARCH_CACHE_MAX_GRANULES', '10000'))
 
 # gets a granule by name and returns the json containing the granule's metadata.
 def get_granule_by_name(granule_name: str,formatmetadata=False) -> Iterable:
     try:
-        response = requests.get(url + 'granulename/' + granule_name)
-        json_str = response.text
+        json_str = granule_cache.get(granule_name)
+        if json_str is None:
+            response = session.get(url + 'granulename/' + granule_name)
+            json_str = response.text
+            # only the granules found are kept, a missing one may be ingested later
+            if response.ok and len(json_str) > 0:
+                granule_cache.put(granule_name, json_str)
       
         # if the response body contains something
         if len(json_str) > 0:
@@ -39,117 +160,181 @@ def get_granule_by_name(granule_name: str,formatmetadata=False) -> Iterable:
         logging.error(str(e))
 
 
-# gets granules by criteria and returns json containing granules' metadata:
-def get_granules_by_criteria(input_file: str='datacriteria.properties',formatmetadata=False) -> Iterable:
-    
-    
-    if Path(input_file).is_file():
-        # load properties file
+# gets several granules by name in parallel and returns a dictionary name -> granule's metadata.
+# each name is fetched once even if it is given several times.
+def get_granules_by_name(granule_names: Iterable) -> dict:
+    names = list(dict.fromkeys(granule_names))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return dict(zip(names, executor.map(get_granule_by_name, names)))
+
+
+class GranuleCriteria:
+    # criteria given as a list -> name of the criteria in the request, in the order of the request
+    lists = OrderedDict([('product_types', 'productTypes'), ('instrument_names', 'instrumentNames'),
+                         ('polarizations', 'polarizations'), ('geometry_types', 'geometryTypes'),
+                         ('processing_levels', 'processingLevels'), ('sub_region_names', 'subRegionNames'),
+                         ('collection_names', 'collectionNames')])
+
+    def __init__(self, start_date: str='', end_date: str='', scene_names=None, **lists):
+        """
+        Search criteria of the catalogue. The lists are given as lists or as comma separated
+        strings like in datacriteria.properties, the scenes are filtered once the granules
+        are received as the catalogue does not know them"""
+        unknown = set(lists) - set(self.lists)
+        if unknown:
+            raise TypeError('Unknown criteria: ' + ', '.join(sorted(unknown)))
+        self.start_date = start_date or ''
+        self.end_date = end_date or ''
+        self.scene_names = to_list(scene_names)
+        for name in self.lists:
+            setattr(self, name, to_list(lists.get(name)))
+
+    # builds the criteria from a properties file, the file is read again only once modified.
+    # returns None when the file does not exist
+    @classmethod
+    def from_file(cls, input_file: str='datacriteria.properties'):
+        try:
+            modified = os.stat(input_file).st_mtime_ns
+        except OSError:
+            print('ERROR: The file "' + input_file + '" does not exist.')
+            logging.error('The file "' + input_file + '" does not exist.')
+            return None
+        cached = criteria_files.get(input_file)
+        if cached and cached[0] == modified:
+            return cached[1]
         data_criteria = Property().load_property_files(input_file)
-        # add the criteria from the properties file to the dictionary
-        criteria_list = {}
-        try :
-            start_date = data_criteria['start_date']
-            if len(start_date) > 0:
-                criteria_list['"startDate"'] = '"' + start_date + '"'
-        except:
-            pass
-        try : 
-            end_date = data_criteria['end_date']
-            if len(end_date) > 0:
-                criteria_list['"endDate"'] = '"' + end_date + '"'
-        except:
-            pass
-        try :    
-            product_types = data_criteria['product_types']
-            if len(product_types) > 0:
-                criteria_list['"productTypes"'] = to_table_string(product_types)
-        except:
-            pass
-        try :    
-            instrument_names = data_criteria['instrument_names']
-            if len(instrument_names) > 0:
-                criteria_list['"instrumentNames"'] = to_table_string(instrument_names)
-        except:
-            pass
-        
-        # location = data_criteria['location']
-        try :
-            polarizations = data_criteria['polarizations']
-            if len(polarizations) > 0:
-                criteria_list['"polarizations"'] = to_table_string(polarizations)
-        except:
-            pass
-        try : 
-            geometry_types = data_criteria['geometry_types']
-            if len(geometry_types) > 0:
-                criteria_list['"geometryTypes"'] = to_table_string(geometry_types)
-        except:
-            pass
-        try : 
-            processing_levels = data_criteria['processing_levels']
-            if len(processing_levels) > 0:
-                criteria_list['"processingLevels"'] = to_table_string(processing_levels)
-        except:
-            pass
-        try : 
-            sub_region_names = data_criteria['sub_region_names']
-            if len(sub_region_names) > 0:
-                criteria_list['"subRegionNames"'] = to_table_string(sub_region_names) 
-        except:
-            pass
-        try : 
-            collectionNames = data_criteria['collection_Names']
-            if len(collectionNames) > 0:
-                criteria_list['"collectionNames"'] = to_table_string(collectionNames)
-        except:
-            pass
-        # if there is at least one criterion besides scene
-        if len(criteria_list) >= 1:
-            # concatenate the criteria from the dictionary together in a string (i.e. "key1": "value1", "key2: "value2")
-            criteria_str = ""
-            for i in criteria_list:
-                key = i
-                value = criteria_list[i]
-                if len(value) > 0:
-                    if len(criteria_str) > 0:
-                        criteria_str += ', '
-                    criteria_str += key + ': ' + value
-            # add the concatenated criteria string it inside a string representing a data criteria json
-            request_body = '{"GranuleCriteria": {' + criteria_str + '}}'
+        lists = {name: data_criteria.get(name, '') for name in cls.lists if name != 'collection_names'}
+        criteria = cls(data_criteria.get('start_date', ''), data_criteria.get('end_date', ''),
+                       data_criteria.get('scene_name', ''), collection_names=data_criteria.get('collection_Names', ''), **lists)
+        criteria_files[input_file] = (modified, criteria)
+        return criteria
+
+    # returns the criteria sent to the catalogue, without the empty ones
+    def to_dict(self) -> dict:
+        criteria = OrderedDict()
+        if self.start_date:
+            criteria['startDate'] = self.start_date
+        if self.end_date:
+            criteria['endDate'] = self.end_date
+        for name, key in self.lists.items():
+            if getattr(self, name):
+                criteria[key] = getattr(self, name)
+        return criteria
+
+    def to_json(self) -> str:
+        return json.dumps({'GranuleCriteria': self.to_dict()})
+
+    # returns the same string for the same search whatever the order of the values
+    def key(self) -> str:
+        return json.dumps({key: sorted(value) if isinstance(value, list) else value
+                           for key, value in self.to_dict().items()}, sort_keys=True)
+
+    def __eq__(self, other):
+        return isinstance(other, GranuleCriteria) and self.key() == other.key() and \
+            sorted(self.scene_names) == sorted(other.scene_names)
+
+    def __repr__(self):
+        return 'GranuleCriteria(' + self.key() + ', scene_names=' + str(self.scene_names) + ')'
+
+
+# criteria read from the properties files: path -> (modification time, criteria)
+criteria_files = {}
+
+
+# returns the values of a comma separated string as a list, lists are copied
+def to_list(values) -> list:
+    if not values:
+        return []
+    if isinstance(values, str):
+        values = values.split(',')
+    return [value.strip() for value in values if value.strip()]
+
+
+# returns the criteria given, or the ones of the properties file when a path is given
+def as_criteria(criteria, **kwargs):
+    if kwargs:
+        return GranuleCriteria(**kwargs)
+    if isinstance(criteria, GranuleCriteria):
+        return criteria
+    return GranuleCriteria.from_file(criteria)
+
+
+# gets granules by criteria and returns json containing granules' metadata. The criteria are
+# read from a properties file, or given as a GranuleCriteria or as keywords (e.g. start_date='2019-01-01').
+def get_granules_by_criteria(input_file='datacriteria.properties',formatmetadata=False, **criteria) -> Iterable:
+    json_obj = [granule for granule in iter_granules_by_criteria(input_file, **criteria)]
+    if len(json_obj) == 0:
+        print('INFO: There is no data matching the given criteria.')
+        logging.info('There is no data matching the given criteria.')
+        return {}
+    if formatmetadata == True:
+        return format_metadata(json_obj)
+    return json_obj
+
+
+# yields the granules matching the criteria one by one as the response of the catalogue is read,
+# the granules of other scenes are skipped. Stopping the iteration closes the connection.
+# The granules of a search read to the end are cached, see search_cache.
+def iter_granules_by_criteria(input_file='datacriteria.properties', **criteria) -> Iterator:
+    criteria = as_criteria(input_file, **criteria)
+    if criteria is None:
+        return
+    if not criteria.to_dict():
+        print('ERROR: You need to specify at least one search criteria besides scene name.')
+        logging.error('You need to specify at least one search criteria besides scene name.')
+        return
+    keep = scene_filter(criteria.scene_names)
+    key = criteria.key()
+    json_str = search_cache.get(key)
+    if json_str is not None:
+        for granule in json.loads(json_str):
+            if keep(granule):
+                yield granule
+        return
+    # all the granules, the ones of the other scenes too, are kept for the cache
+    # until there are too many of them
+    found = [] if search_cache.ttl > 0 else None
+    try:
+        with session.post(url, headers={'content-type': 'application/json'}, data=criteria.to_json(), stream=True) as response:
+            response.raise_for_status()
+            decoder = codecs.getincrementaldecoder(response.encoding or 'utf-8')()
+            chunks = (decoder.decode(chunk) for chunk in response.iter_content(chunk_size=chunk_size))
+            for granule in iter_json_array(chunks):
+                if found is not None:
+                    found.append(granule)
+                    if len(found) > search_cache_max_granules:
+                        found = None
+                if keep(granule):
+                    yield granule
+        if found is not None:
+            search_cache.put(key, json.dumps(found))
+    except requests.exceptions.RequestException as e:
+        print('ERROR: ' + str(e))
+        logging.error(str(e))
+
+
+# yields the items of a json array read piece by piece, each item is decoded as soon as it is complete
+def iter_json_array(chunks: Iterable) -> Iterator:
+    decoder = json.JSONDecoder()
+    buffer = ''
+    for chunk in chunks:
+        buffer += chunk
+        position = 0
+        while True:
+            # skip the brackets opening the array, the separators and the whitespaces
+            while position < len(buffer) and buffer[position] in '[, \t\r\n':
+                position += 1
+            if position == len(buffer) or buffer[position] == ']':
+                break
             try:
-                response = requests.post(url, headers={'content-type': 'application/json'}, data=request_body)
-                json_str = response.text
-                # if the response body contains something
-                if len(json_str) > 0:
-                    json_obj = json.loads(json_str)
-                    #return filter_by_scene(json_obj, data_criteria['scene_name'].split(','))
-                    if data_criteria['scene_name']:
-                        print(data_criteria['scene_name'].split(','))
-                        json_obj=filter_by_scene(json_obj, data_criteria['scene_name'].split(','))
-                        
-                        if formatmetadata == True:
-                            return format_metadata(json_obj)
-                        else:
-                            return json_obj
-                    else:
-                        if formatmetadata==True:
-                            return format_metadata(json_obj)
-                        else : 
-                            return json_obj
-                else:
-                    print('INFO: There is no data matching the given criteria.')
-                    logging.info('There is no data matching the given criteria.')
-                    return {}
-            except requests.exceptions.RequestException as e:
-                print('ERROR: ' + str(e))
-                logging.error(str(e))
-        else:
-            print('ERROR: You need to specify at least one search criteria besides scene name.')
-            logging.error('You need to specify at least one search criteria besides scene name.')
-    else:
-        print('ERROR: The file "' + input_file + '" does not exist.')
-        logging.error('The file "' + input_file + '" does not exist.')
+                item, position = decoder.raw_decode(buffer, position)
+            except ValueError:
+                # the item is not complete yet
+                break
+            yield item
+        buffer = buffer[position:]
+    if buffer.strip() not in ('', ']'):
+        raise ValueError('The response of the catalogue is not a complete json array')
 
 
 # returns the string passed as parameter as a string representing a table (e.g. ["a", "b", "c"])
@@ -158,51 +343,96 @@ def to_table_string(string: str) -> str:
     return '["' + string_to_return + '"]'
 
 
-def filter_by_scene(json_result, scene_list):
+# returns a predicate keeping the granules of the given scenes, and the granules with no scene
+def scene_filter(scene_list):
+    if not scene_list:
+        return lambda granule: True
+    scenes = set(scene_list)
 
-    for granule in json_result[:] : 
+    def keep(granule):
         scene = granule['Granule']['granuleScene']
-        if scene:
-            scene=granule['Granule']['granuleScene']['Granule']['name']
-            print(scene)
-            if not scene in scene_list : 
-                json_result.remove(granule)
-             
+        return not scene or scene['Granule']['name'] in scenes
+    return keep
+
+
+def filter_by_scene(json_result, scene_list):
+    json_result[:] = filter(scene_filter(scene_list), json_result)
     return json_result
 
+# downloads one file through a temporary file renamed once the file is complete, so a file
+# found in the target dir is never a truncated one. The file is written chunk by chunk.
+def download_data(urlToData: str, completeName: str):
+    # one temporary name per process and thread, several kernels may download the same file
+    tmpName = '%s.%d.%d.part' % (completeName, os.getpid(), threading.get_ident())
+    try:
+        with open(tmpName, 'wb') as f:
+            with session.get(urlToData, allow_redirects=True, stream=True) as r:
+                r.raise_for_status()
+                for chunk in r.iter_content(chunk_size=chunk_size):
+                    f.write(chunk)
+        os.replace(tmpName, completeName)
+    except BaseException:
+        if os.path.exists(tmpName):
+            os.remove(tmpName)
+        raise
+
+
+# downloads (urlToData, fileName) files in target_Dir in parallel and returns the names of the files that failed
+def download_files(files: Iterable, target_Dir: str) -> list:
+    def download(urlToData, fileName):
+        try:
+            download_data(urlToData, os.path.join(target_Dir, fileName))
+            print(fileName+' has been successfully downloaded in targetDir: '+ target_Dir)
+            logging.info(fileName+' has been successfully downloaded in targetDir: '+ target_Dir)
+        except (requests.exceptions.RequestException, OSError) as e:
+            print('ERROR: ' + fileName + ': ' + str(e))
+            logging.error(fileName + ': ' + str(e))
+            return fileName
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        failed = executor.map(lambda file: download(*file), files)
+        return [fileName for fileName in failed if fileName]
+
+
+# returns the (urlToData, fileName) files of a granule that are not yet in target_Dir,
+# and the url of the last file of the granule ('' when it was already there)
+def granule_files(json_obj, target_Dir: str):
+    files = []
+    urlToData = ''
+    for data in json_obj['Granule']['dataList'][:] :
+        #print(target_Dir+'/'+data['Data']['fileName'])
+        my_file = Path(target_Dir+'/'+data['Data']['fileName'])
+        urlToData=''
+        if my_file.is_file():
+            print(data['Data']['fileName']+' already exists in targetDir: '+ target_Dir)
+            logging.info(data['Data']['fileName']+' already exists in targetDir: '+ target_Dir)
+        else:
+            urlToData = data['Data']['urlToData']
+            files.append((urlToData, data['Data']['fileName']))
+    return files, urlToData
+
+
 # download granule data(s) in a specified dir:
 # granule_id: granuleID.
 # target_Dir: directory the file(s) will be saved at".
 def download_granule(granule_id: str, target_Dir: str) -> Iterable:
-    try:
-        response = requests.get(url + 'granulename/' + granule_id)
-        json_str = response.text
-        # if the response body contains something
-        if len(json_str) > 0:
-            json_obj = json.loads(response.text)
-            for data in json_obj['Granule']['dataList'][:] :
-                #print(target_Dir+'/'+data['Data']['fileName'])
-                my_file = Path(target_Dir+'/'+data['Data']['fileName'])
-                urlToData=''
-                if my_file.is_file():
-                    print(data['Data']['fileName']+' already exists in targetDir: '+ target_Dir)
-                    logging.info(data['Data']['fileName']+' already exists in targetDir: '+ target_Dir)
-                else:
-                    urlToData = data['Data']['urlToData']
-                    completeName = os.path.join(target_Dir, data['Data']['fileName'])
-                    r = requests.get(urlToData, allow_redirects=True)
-                    open(completeName, 'wb').write(r.content)
-                    print(data['Data']['fileName']+' has been successfully downloaded in targetDir: '+ target_Dir)
-                    logging.info(data['Data']['fileName']+' has been successfully downloaded in targetDir: '+ target_Dir)
-                    
-            return urlToData
-        else:
-            print('INFO: There is no data with ID: ' + granule_id)
-            logging.info('There is no data with ID: ' + granule_id)
-            return {}
-    except requests.exceptions.RequestException as e:
-        print('ERROR: ' + str(e))
-        logging.error(str(e))
+    return download_granules([granule_id], target_Dir)[granule_id]
+
+
+# download the data(s) of several granules in a specified dir, the files of all the granules
+# are downloaded together. Returns a dictionary granuleID -> url of its last file, as download_granule
+def download_granules(granule_ids: Iterable, target_Dir: str) -> dict:
+    results = {}
+    files = []
+    for granule_id, json_obj in get_granules_by_name(granule_ids).items():
+        # the granule was not found, or the catalogue could not be reached
+        if not json_obj:
+            results[granule_id] = json_obj
+            continue
+        granule_data, results[granule_id] = granule_files(json_obj, target_Dir)
+        files.extend(granule_data)
+    download_files(files, target_Dir)
+    return results
 
 
 
@@ -211,29 +441,208 @@ def download_granule(granule_id: str, target_Dir: str) -> Iterable:
 #########################################################################
 
 # -*- coding: utf-8 -*-
+class SceneTable:
+    # numeric columns, kept in arrays of floats (NaN when the value is missing)
+    numeric = ('heading', 'zFlight', 'zTerrain', 'grdResol', 'pixelSpacing', 'surfaceResol', 'slrStart')
+    # text columns, the names of the master and of the dem and the file names
+    text = ('master', 'dem', 'demFilename', 'azimuthFile', 'rangeFile', 'incFilename', 'kzFilename')
+    __slots__ = ('names', 'rows') + numeric + text
+
+    def __init__(self):
+        """
+        The metadata of the scenes of a stack, one row per scene. Row i of every column
+        belongs to the scene names[i], rows gives the row of a scene"""
+        self.names = []
+        self.rows = {}
+        for column in self.numeric:
+            setattr(self, column, array('d'))
+        for column in self.text:
+            setattr(self, column, [])
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, scene):
+        return scene in self.rows
+
+    # adds a scene and returns its row, the columns not given are NaN or empty
+    def append(self, scene: str, **values) -> int:
+        row = len(self.names)
+        self.rows[scene] = row
+        self.names.append(scene)
+        for column in self.numeric:
+            getattr(self, column).append(to_float(values.get(column)))
+        for column in self.text:
+            getattr(self, column).append(values.get(column) or '')
+        return row
+
+    # sets a value of a scene, the scene is added when it is not in the table yet
+    def set(self, scene: str, column: str, value):
+        row = self.rows[scene] if scene in self.rows else self.append(scene)
+        getattr(self, column)[row] = to_float(value) if column in self.numeric else value
+
+    # returns the rows of the scenes matching all the conditions, in order. A numeric column is
+    # given a (min, max) range, None for no bound, and a text column a value or a set of values
+    def where(self, **conditions) -> list:
+        rows = range(len(self.names))
+        for column, condition in conditions.items():
+            values = getattr(self, column)
+            if column in self.numeric:
+                low = float('-inf') if condition[0] is None else condition[0]
+                high = float('inf') if condition[1] is None else condition[1]
+                rows = [row for row in rows if low <= values[row] <= high]
+            else:
+                accepted = {condition} if isinstance(condition, str) else set(condition)
+                rows = [row for row in rows if values[row] in accepted]
+        return [*rows]
+
+    # returns a new table with the given rows, in the given order
+    def select(self, rows: Iterable):
+        table = SceneTable()
+        rows = [*rows]
+        table.names = [self.names[row] for row in rows]
+        table.rows = {scene: row for row, scene in enumerate(table.names)}
+        for column in self.numeric:
+            values = getattr(self, column)
+            setattr(table, column, array('d', (values[row] for row in rows)))
+        for column in self.text:
+            values = getattr(self, column)
+            setattr(table, column, [values[row] for row in rows])
+        return table
+
+    # returns the columns of the table, the scene names first: column -> array or list
+    def columns(self) -> OrderedDict:
+        columns = OrderedDict([('scene', self.names)])
+        for column in self.numeric + self.text:
+            columns[column] = getattr(self, column)
+        return columns
+
+
+class SceneColumn(MutableMapping):
+    __slots__ = ('table', 'column')
+
+    def __init__(self, table: SceneTable, column: str):
+        """
+        A column of a scene table seen as a dictionary scene -> value, as the metadata of
+        the dataset were dictionaries before. The dictionary is a view, not a copy"""
+        self.table = table
+        self.column = column
+
+    def __getitem__(self, scene):
+        return getattr(self.table, self.column)[self.table.rows[scene]]
+
+    def __setitem__(self, scene, value):
+        self.table.set(scene, self.column, value)
+
+    def __delitem__(self, scene):
+        raise TypeError('The scenes of a dataset are removed with dataset.filter')
+
+    def __iter__(self):
+        return iter(self.table.names)
+
+    def __len__(self):
+        return len(self.table.names)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+# returns the value as a float, NaN when it is missing or not a number
+def to_float(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float('nan')
+
+
+def import_pandas():
+    try:
+        import pandas
+    except ImportError:
+        raise ImportError('Exporting a dataset needs pandas, install it with: pip install pandas')
+    return pandas
+
+
 class dataset:
+    # metadata of the scenes, as dictionaries scene -> value, and their column in the scene table
+    scene_columns = OrderedDict([('heading', 'heading'), ('z_flight', 'zFlight'), ('z_terrain', 'zTerrain'),
+                                 ('GRD_resol', 'grdResol'), ('pixel_spacing', 'pixelSpacing'),
+                                 ('surface_resol', 'surfaceResol'), ('SLR_start', 'slrStart'),
+                                 ('master', 'master'), ('demname', 'dem'), ('demFilenames', 'demFilename'),
+                                 ('azimuthFiles', 'azimuthFile'), ('rangeFiles', 'rangeFile'),
+                                 ('incFilenames', 'incFilename'), ('kzFilenames', 'kzFilename')])
+    __slots__ = ('campaign', 'SLClist', 'SLCFilenames', 'table')
+
     def __init__(self):
         """
-        This class contains the dataset and all the auxiliary information"""
+        This class contains the dataset and all the auxiliary information. The SLC granules
+        are kept by (scene, polarisation), the metadata of the scenes in a SceneTable"""
         self.campaign = ""
-        self.scenes = []
         self.SLClist = {}
         self.SLCFilenames = {}
-        self.heading={}
-        self.z_flight={}
-        self.z_terrain={}
-        self.GRD_resol={}
-        self.pixel_spacing = {}
-        self.surface_resol = {}
-        self.SLR_start = {}
-        self.master = {}
-        self.demname = {}
-        self.demFilenames= {}
-        self.incFilenames = {}
-        self.kzFilenames = {}
-        self.azimuthFiles = {}
-        self.rangeFiles = {}
-        
+        self.table = SceneTable()
+
+    # the scene metadata are still read as dictionaries, e.g. data_stack.heading[scene]
+    def __getattr__(self, name):
+        if name in dataset.scene_columns:
+            return SceneColumn(self.table, dataset.scene_columns[name])
+        raise AttributeError(name)
+
+    # and set as dictionaries, e.g. data_stack.heading = {scene: 45.0}, the scenes not
+    # given keep their value
+    def __setattr__(self, name, value):
+        if name in dataset.scene_columns:
+            for scene, scene_value in dict(value).items():
+                self.table.set(scene, dataset.scene_columns[name], scene_value)
+        else:
+            object.__setattr__(self, name, value)
+
+    # a copy of the names of the scenes, they are added by setting their metadata
+    @property
+    def scenes(self) -> list:
+        return [*self.table.names]
+
+    # returns a new dataset with the scenes given and the scenes matching the conditions
+    # (see SceneTable.where), e.g. data_stack.filter(heading=(0, 90), master='n/a')
+    def filter(self, scenes: Iterable=None, **conditions):
+        rows = self.table.where(**conditions)
+        if scenes is not None:
+            scenes = set(scenes)
+            rows = [row for row in rows if self.table.names[row] in scenes]
+        filtered = dataset()
+        filtered.campaign = self.campaign
+        filtered.table = self.table.select(rows)
+        filtered.SLClist = {key: value for key, value in self.SLClist.items() if key[0] in filtered.table}
+        filtered.SLCFilenames = {key: value for key, value in self.SLCFilenames.items() if key[0] in filtered.table}
+        return filtered
+
+    # returns the scene table as a pandas.DataFrame indexed by scene
+    def to_pandas(self):
+        pandas = import_pandas()
+        columns = self.table.columns()
+        return pandas.DataFrame({column: [*values] for column, values in columns.items() if column != 'scene'},
+                                index=pandas.Index(columns['scene'], name='scene'))
+
+    # writes the scene table to a Parquet file, this needs pandas and pyarrow
+    def to_parquet(self, path: str):
+        self.to_pandas().to_parquet(path)
+
+    # returns the stack as columns with one row per SLC granule: column -> list of values,
+    # e.g. pandas.DataFrame(data_stack.columns())
+    def columns(self) -> OrderedDict:
+        scene_columns = OrderedDict((name, getattr(self.table, column)) for name, column in dataset.scene_columns.items())
+        columns = OrderedDict((name, []) for name in ['campaign', 'scene', 'polarization', 'SLC', 'SLCFilename'] + [*scene_columns])
+        for (scene, polarization), name in self.SLClist.items():
+            row = self.table.rows[scene]
+            columns['campaign'].append(self.campaign)
+            columns['scene'].append(scene)
+            columns['polarization'].append(polarization)
+            columns['SLC'].append(name)
+            columns['SLCFilename'].append(self.SLCFilenames[(scene, polarization)])
+            for column, values in scene_columns.items():
+                columns[column].append(values[row])
+        return columns
+
 def get_url(collection,granulename):
     granule=get_granule_by_name(collection+':@'+granulename)
     datalist=granule['Granule']['dataList']
@@ -241,164 +650,140 @@ def get_url(collection,granulename):
     url=datalist[0]['Data']['filePath']
     return(url)
 
-def format_metadata(json_result):
-    """Parse configuration xml and init dataset class"""
-    import re
+# one pattern for the files of a scene, the group is the type of the file
+scene_file_pattern = re.compile(r'(az|rg|inc|kz).tiff')
+# the files a scene takes from its master when it has none
+master_file_tokens = ('az', 'rg', 'inc')
+
+# returns the first file of each type in the file list of a scene: type (az, rg, inc or kz) -> file name
+def scene_files(granule_list) -> dict:
+    files = {}
+    for data in granule_list:
+        match = scene_file_pattern.search(data)
+        if match and match.group(1) not in files:
+            files[match.group(1)] = data
+    return files
+
+# returns the first file containing each of az, rg and inc in the file list of a master: token -> file name
+def master_files(granule_list) -> dict:
+    files = {}
+    for data in granule_list:
+        for token in master_file_tokens:
+            if token not in files and token in data:
+                files[token] = data
+    return files
+
+def get_stack_granules(json_result, collection):
+    """Fetch at once every granule format_metadata needs: the SLC, dem, az, rg, inc and kz
+    files of the scenes, then the az, rg and inc files of the masters for the scenes that
+    have none. Returns a dictionary granule name -> granule"""
+    names = []
+    masters = []
+    for granule in json_result:
+        if granule['Granule']['productType'] != 'SLC':
+            continue
+        scene = granule['Granule']['granuleScene']['Granule']
+        names.append(granule['Granule']['name'])
+        if len(scene['dem']) > 0:
+            names.append(collection+'_'+scene['dem']+'_dem.tiff')
+        files = scene_files(scene['granuleList'])
+        names.extend(files.values())
+        if len(files.keys() & set(master_file_tokens)) < len(master_file_tokens) and \
+                scene['master'] != 'n/a' and len(scene['master']) > 0:
+            masters.append(scene['master'])
+    granules = get_granules_by_name([collection+':@'+name for name in names + masters])
+
+    # the files of the masters are known once the masters are fetched
+    master_names = []
+    for master in dict.fromkeys(masters):
+        try:
+            files = master_files(granules[collection+':@'+master]['Granule']['granuleList'])
+        except (KeyError, TypeError):
+            continue
+        master_names.extend(collection+':@'+file for file in files.values() if collection+':@'+file not in granules)
+    granules.update(get_granules_by_name(master_names))
+    return granules
+
+def format_metadata(json_result, columnar=False):
+    """Parse configuration xml and init dataset class. The granules are read once, in order,
+    and the stack may have any number of scenes and polarisations. With columnar, returns
+    the columns of the stack instead, see dataset.columns"""
     
     
     # Init
     data_stack = dataset()
     print(len(json_result))
-    if json_result and len(json_result) == 5:
+    if json_result:
         data_stack.campaign = json_result[0]['Granule']['collection']['Collection']['shortName']
-        #if the research asked some specific scenes
-        
-        
-            
+        # all the granules of the stack are fetched first, in parallel
+        granules = get_stack_granules(json_result, data_stack.campaign)
+
+        def get_granule(granulename):
+            name = data_stack.campaign+':@'+granulename
+            if name not in granules:
+                granules[name] = get_granule_by_name(name)
+            return granules[name]
+
+        def get_url(granulename):
+            return get_granule(granulename)['Granule']['dataList'][0]['Data']['filePath']
+
+        # files of the masters already looked up: master -> token -> file name
+        masters = {}
+
+        def get_master_url(master, token):
+            try:
+                if master not in masters:
+                    masters[master] = master_files(get_granule(master)['Granule']['granuleList'])
+                return get_url(masters[master][token])
+            except:
+                return ''
+
         # All the data of the collections are returned and the scene list must be extract from the granules
         for granule in json_result :
-            if granule['Granule']['productType']=='SLC':
-                scene=granule['Granule']['granuleScene']['Granule']['name']   
-                #add scene in the list avoiding duplicates
-                
-                
-                ## inputfilenames
-                polarisation=granule['Granule']['polarization']
-                key=(scene,polarisation)
-                value=granule['Granule']['name']
-                url=get_url(data_stack.campaign,value)
-                
-                data_stack.SLClist.update(dict([(key,value)]))
-                data_stack.SLCFilenames.update(dict([(key,url)]))
-                if not scene in data_stack.scenes:
-                    #append scenes and all metadata of the scene
-                    data_stack.scenes.append(scene)            
-                    
-                    
-                        
-                    #### heading
-                    keyval=dict([(scene,granule['Granule']['granuleScene']['Granule']['heading'])])
-                    data_stack.heading.update(keyval)
-                    #z_flight
-                    keyval=dict([(scene,granule['Granule']['granuleScene']['Granule']['zFlight'])])
-                    data_stack.z_flight.update(keyval)
-                    ##z_terrain
-                    keyval=dict([(scene,granule['Granule']['granuleScene']['Granule']['zTerrain'])])
-                    data_stack.z_terrain.update(keyval)
-                    ##GRD_resol
-                    keyval=dict([(scene,granule['Granule']['granuleScene']['Granule']['grdResol'])])
-                    data_stack.GRD_resol.update(keyval)
-                    ##pixel_spacing
-                    keyval=dict([(scene,granule['Granule']['granuleScene']['Granule']['pixelSpacing'])])
-                    data_stack.pixel_spacing.update(keyval)
-                    ##surface_resol
-                    keyval=dict([(scene,granule['Granule']['granuleScene']['Granule']['surfaceResol'])])
-                    data_stack.surface_resol.update(keyval)
-                    
-                    ##SLR_start
-                    keyval=dict([(scene,granule['Granule']['granuleScene']['Granule']['slrStart'])])
-                    data_stack.SLR_start.update(keyval)
-                    
-                    ##master
-                    #search for the presence of az files in the file list of the granule
-                    #bool_list=bool(re.search("az.tiff",data)) for data in granule['Granule']['granuleScene']['Granule']['granuleList']]                    
-                    #if True in bool_list : 
-                    keyval=dict([(scene,granule['Granule']['granuleScene']['Granule']['master'])])
-                    data_stack.master.update(keyval)
-                    ##demname
-                    keyval=dict([(scene,granule['Granule']['granuleScene']['Granule']['dem'])])
-                    data_stack.demname.update(keyval)
-                    
-                    ##demFilenames
-                    demname=granule['Granule']['granuleScene']['Granule']['dem']
-                    #if a dem is referenced, try to get its filename
-                    if len(demname)>0:
-                        try :
-                            demfilename=get_url(data_stack.campaign,data_stack.campaign+'_'+demname+'_dem.tiff')
-                            
-                        except:
-                            demfilename=''
-                    else : 
-                            demfilename=''
-                    keyval=dict([(scene,demfilename)])
-                    data_stack.demFilenames.update(keyval)
-                    
-                    ##azfilenames
-                    #search for the presence of az files in the file list of the granule
-                    bool_list=[bool(re.search("az.tiff",data)) for data in granule['Granule']['granuleScene']['Granule']['granuleList']]     
-                    if True in bool_list :
-                        azfile=granule['Granule']['granuleScene']['Granule']['granuleList'][bool_list.index(True)]
-                        azfile=get_url(data_stack.campaign,azfile)
-                    elif  granule['Granule']['granuleScene']['Granule']['master']!='n/a':
-                        #get master name and get its azimtuh
-                        master=granule['Granule']['granuleScene']['Granule']['master']
-                        
-                        if len(master)>0:
-                            try : 
-                                master_granules=get_granule_by_name(data_stack.campaign+':@'+master)['Granule']['granuleList']
-                                
-                                azfile=[file for file in master_granules if "az" in file][0]      
-                                azfile=get_url(data_stack.campaign,azfile)
-                            except: 
-                                azfile=''
-                        else:
-                            azfile=''
-                    else:
-                        azfile=''
-                    keyval=dict([(scene,azfile)])
-                    data_stack.azimuthFiles.update(keyval)
-                    
-                    ##rgfilenames
-                    bool_list=[bool(re.search("rg.tiff",data)) for data in granule['Granule']['granuleScene']['Granule']['granuleList']]     
-                    if True in bool_list :
-                        rgfile=granule['Granule']['granuleScene']['Granule']['granuleList'][bool_list.index(True)]
-                        rgfile=get_url(data_stack.campaign,rgfile)
-                    elif  granule['Granule']['granuleScene']['Granule']['master']!='n/a':
-                        #get master name and get its azimtuh
-                        master=granule['Granule']['granuleScene']['Granule']['master']
-                        if len(master)>0:
-                            try : 
-                                master_granules=get_granule_by_name(data_stack.campaign+':@'+master)['Granule']['granuleList']
-                                rgfile=[file for file in master_granules if "rg" in file][0]    
-                                rgfile=get_url(data_stack.campaign,rgfile)
-                            except: 
-                                rgfile=''
-                        else:
-                            rgfile=''
-                    else:
-                        rgfile=''
-                    keyval=dict([(scene,rgfile)])
-                    data_stack.rangeFiles.update(keyval)
-                    
-                    ##incfilenames
-                    bool_list=[bool(re.search("inc.tiff",data)) for data in granule['Granule']['granuleScene']['Granule']['granuleList']]     
-                    if True in bool_list :
-                        incfile=granule['Granule']['granuleScene']['Granule']['granuleList'][bool_list.index(True)]
-                        incfile=get_url(data_stack.campaign,incfile)
-                    elif  granule['Granule']['granuleScene']['Granule']['master']!='n/a':
-                        #get master name and get its azimtuh
-                        master=granule['Granule']['granuleScene']['Granule']['master']
-                        if len(master)>0:
-                            try : 
-                                master_granules=get_granule_by_name(data_stack.campaign+':@'+master)['Granule']['granuleList']
-                                incfile=[file for file in master_granules if "inc" in file][0] 
-                                incfile=get_url(data_stack.campaign,incfile)
-                            except: 
-                                incfile=''
-                        else:
-                            incfile=''
-                    else:
-                        incfile=''
-                    keyval=dict([(scene,incfile)])
-                    data_stack.incFilenames.update(keyval)
-                                   
-                    ##kzfilenames
-                    bool_list=[bool(re.search("kz.tiff",data)) for data in granule['Granule']['granuleScene']['Granule']['granuleList']]     
-                    if True in bool_list :
-                        kzfile=granule['Granule']['granuleScene']['Granule']['granuleList'][bool_list.index(True)]
-                        kzfile=get_url(data_stack.campaign,kzfile)
-                    else:
-                        kzfile=''
-                    keyval=dict([(scene,kzfile)])
-                    data_stack.kzFilenames.update(keyval)
-        return data_stack
+            granule = granule['Granule']
+            if granule['productType'] != 'SLC':
+                continue
+            scene_granule = granule['granuleScene']['Granule']
+            scene = scene_granule['name']
+
+            ## inputfilenames
+            key = (scene, granule['polarization'])
+            data_stack.SLClist[key] = granule['name']
+            data_stack.SLCFilenames[key] = get_url(granule['name'])
+            # the metadata of a scene are taken from its first granule
+            if scene in data_stack.table:
+                continue
+
+            ##demFilenames
+            #if a dem is referenced, try to get its filename
+            demfilename = ''
+            if len(scene_granule['dem']) > 0:
+                try :
+                    demfilename = get_url(data_stack.campaign+'_'+scene_granule['dem']+'_dem.tiff')
+                except:
+                    pass
+
+            ##az, rg and inc filenames, taken from the master when the scene has none
+            files = scene_files(scene_granule['granuleList'])
+            master = scene_granule['master']
+            filenames = {}
+            for token in master_file_tokens:
+                if token in files:
+                    filenames[token] = get_url(files[token])
+                elif master != 'n/a' and len(master) > 0:
+                    filenames[token] = get_master_url(master, token)
+                else:
+                    filenames[token] = ''
+
+            ##kzfilenames
+            filenames['kz'] = get_url(files['kz']) if 'kz' in files else ''
+
+            data_stack.table.append(scene, heading=scene_granule['heading'], zFlight=scene_granule['zFlight'],
+                                    zTerrain=scene_granule['zTerrain'], grdResol=scene_granule['grdResol'],
+                                    pixelSpacing=scene_granule['pixelSpacing'], surfaceResol=scene_granule['surfaceResol'],
+                                    slrStart=scene_granule['slrStart'], master=master, dem=scene_granule['dem'],
+                                    demFilename=demfilename, azimuthFile=filenames['az'], rangeFile=filenames['rg'],
+                                    incFilename=filenames['inc'], kzFilename=filenames['kz'])
+    if columnar:
+        return data_stack.columns()
+    return data_stack
@@ -0,0 +1,2493 @@
+import sys, getopt
+import requests
+from urllib3.util.retry import Retry
+from urllib.parse import urlparse, parse_qs
+import json
+import sys
+import os
+import time
+import math
+import random
+import mmap
+import base64
+import hashlib
+import binascii
+import os.path as path
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import asyncio
+# Import getopt module
+import getopt
+
+
+MAAP_ENV_TYPE = os.getenv("MAAP_ENV_TYPE")
+CLIENT_ID = os.getenv("CLIENT_ID")
+BEARER=""
+#Number of parts sent in parallel during a multipart upload
+MAAP_S3_WORKERS = int(os.getenv("MAAP_S3_WORKERS", "4"))
+#Retries of a request that failed to connect, the statuses are retried by RetryPolicy
+MAAP_S3_HTTP_RETRIES = int(os.getenv("MAAP_S3_HTTP_RETRIES", "3"))
+#Number of presigned urls generated at once, and their lifetime when the url does not tell it
+MAAP_S3_URL_WINDOW = int(os.getenv("MAAP_S3_URL_WINDOW", "100"))
+PRESIGNED_URL_LIFETIME = 3600
+#A presigned url is renewed this many seconds before it expires
+PRESIGNED_URL_MARGIN = 60
+#Part sizing of the multipart upload
+MAAP_S3_TARGET_PARTS = int(os.getenv("MAAP_S3_TARGET_PARTS", "1000"))
+MAAP_S3_MEMORY_BUDGET = int(os.getenv("MAAP_S3_MEMORY_BUDGET", str(512 * 1024 * 1024)))
+#S3 limits of a multipart upload
+S3_MIN_PART_SIZE = 5 * 1024 * 1024
+S3_MAX_PART_SIZE = 5 * 1024 * 1024 * 1024
+S3_MAX_PARTS = 10000
+#Number of objects asked per listing page, and how long in seconds a listing is
+#reused by the next list commands (0 disables the cache)
+MAAP_S3_LIST_PAGE_SIZE = int(os.getenv("MAAP_S3_LIST_PAGE_SIZE", "1000"))
+MAAP_S3_LIST_CACHE_TTL = int(os.getenv("MAAP_S3_LIST_CACHE_TTL", "0"))
+#Checksum manifest stored next to each multipart upload, set MAAP_S3_MANIFEST to 0 to stop
+#writing it. A file sent in one request is checked by the S3 against its MD5
+MAAP_S3_MANIFEST = os.getenv("MAAP_S3_MANIFEST", "1") != "0"
+MANIFEST_SUFFIX = ".maap-manifest.json"
+#Number of deletions submitted at once by a bulk delete
+DELETE_BATCH_SIZE = 100
+#Size of the byte ranges fetched in parallel by a download
+MAAP_S3_SEGMENT_SIZE = int(os.getenv("MAAP_S3_SEGMENT_SIZE", str(16 * 1024 * 1024)))
+#Size of the buffers written to disk while downloading
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+#Files bigger than this are uploaded in parallel parts
+MAAP_S3_MULTIPART_THRESHOLD = int(os.getenv("MAAP_S3_MULTIPART_THRESHOLD", str(100 * 1024 * 1024)))
+#Bandwidth limits in bytes per second (K, M and G suffixes accepted, 0 is unlimited) shared
+#by all the transfers, and of each transfer; a transfer gets a share of the global limit
+#proportional to its priority
+MAAP_S3_BANDWIDTH = os.getenv("MAAP_S3_BANDWIDTH", "0")
+MAAP_S3_TRANSFER_BANDWIDTH = os.getenv("MAAP_S3_TRANSFER_BANDWIDTH", "0")
+MAAP_S3_PRIORITY = int(os.getenv("MAAP_S3_PRIORITY", "1"))
+#Attempts of a part or a segment before the transfer fails, and the bounds in seconds of
+#the wait between attempts: a random time up to base * 2^attempt, at most cap
+MAAP_S3_RETRIES = int(os.getenv("MAAP_S3_RETRIES", "5"))
+MAAP_S3_RETRY_BASE = float(os.getenv("MAAP_S3_RETRY_BASE", "0.5"))
+MAAP_S3_RETRY_CAP = float(os.getenv("MAAP_S3_RETRY_CAP", "30"))
+#Set MAAP_S3_VERIFY_ETAG to 1 to also compare the ETags of the parts with their MD5, only
+#for buckets without KMS encryption (the S3 already checks each part against its Content-MD5)
+MAAP_S3_VERIFY_ETAG = os.getenv("MAAP_S3_VERIFY_ETAG", "0") == "1"
+#Statuses for which a part or a segment is sent again
+RETRYABLE_STATUS = (408, 429, 500, 502, 503, 504)
+#Transfer backend of the Client, thread or asyncio (needs aiohttp), the requests kept
+#in flight by the asyncio backend and the threads reading and writing its files
+MAAP_S3_BACKEND = os.getenv("MAAP_S3_BACKEND", "thread")
+MAAP_S3_ASYNC_REQUESTS = int(os.getenv("MAAP_S3_ASYNC_REQUESTS", "256"))
+MAAP_S3_ASYNC_READERS = int(os.getenv("MAAP_S3_ASYNC_READERS", "4"))
+#Files of a folder transferred at once by the asyncio backend
+MAAP_S3_ASYNC_FILES = int(os.getenv("MAAP_S3_ASYNC_FILES", "16"))
+#if windows we take the current folder
+if sys.platform == 'win32':
+   USER_INFO_FILE_PATH=os.path.join(os.getcwd(), "maap-s3-userinfo.json")
+   USER_LAST_UPLOAD_INFO_FILE_PATH=os.path.join(os.getcwd(), "maap-s3-multipartinfo.json")
+   USER_LAST_DOWNLOAD_INFO_FILE_PATH=os.path.join(os.getcwd(), "maap-s3-downloadinfo.json")
+   TRANSFER_LOG_FILE_PATH=os.path.join(os.getcwd(), "maap-s3-transfers.jsonl")
+   SYNC_INFO_FILE_PATH=os.path.join(os.getcwd(), "maap-s3-syncinfo.json")
+   LIST_CACHE_FILE_PATH=os.path.join(os.getcwd(), "maap-s3-listcache.json")
+else :
+   USER_INFO_FILE_PATH="/usr/bmap/maap-s3-userinfo.json"
+   USER_LAST_UPLOAD_INFO_FILE_PATH="/usr/bmap/maap-s3-multipartinfo.json"
+   USER_LAST_DOWNLOAD_INFO_FILE_PATH="/usr/bmap/maap-s3-downloadinfo.json"
+   TRANSFER_LOG_FILE_PATH="/usr/bmap/maap-s3-transfers.jsonl"
+   SYNC_INFO_FILE_PATH="/usr/bmap/maap-s3-syncinfo.json"
+   LIST_CACHE_FILE_PATH="/usr/bmap/maap-s3-listcache.json"
+#The transfer log (one json object per line) can be moved or disabled with an empty value
+TRANSFER_LOG_FILE_PATH = os.getenv("MAAP_S3_TRANSFER_LOG", TRANSFER_LOG_FILE_PATH)
+#Upper bounds in seconds of the part latency histogram
+LATENCY_BUCKETS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+   
+userinfo = {}
+multipartinfo = {}
+#Every data request (part, segment or small file) takes a slot,
+#so directory transfers share the same bound on parallel requests
+TRANSFER_SLOTS = threading.BoundedSemaphore(MAAP_S3_WORKERS)
+client = None
+client_lock = threading.Lock()
+#Clients not yet closed, the last one closes the connections
+open_clients = 0
+#A token is generated again this many seconds before it expires
+TOKEN_REFRESH_MARGIN = 300
+#Lifetime of a token when neither the token nor the iam tells it
+TOKEN_LIFETIME = 3600
+
+def display_help():
+    print('Usage: [option...] {upload|download|list|delete|refresh|resume|resume-download|upload-dir|download-dir|sync}')
+    #print('-i                                                                   Get a fresh token before any request. It ask for email and password')
+    print('upload     myFile.tiff locally          path/myFile.tiff in the S3    Upload data in the S3')
+    print('download   myFileName.tiff              path/in/S3/file.tiff          Download a data from the S3')
+    print('list       folder/path                  [--recursive] [--json]        List data in a subfolder')
+    print('delete     path/in/S3/file.tiff                                       Delete an existing data on S3')
+    print('delete     --prefix path/in/S3|--from-file keys.txt  [--dry-run]      Delete all the data of a folder or listed in a file')
+    print('refresh                                                               Refresh credentials and password')
+    print('token      email                        password                      Return a bearer token')
+    print('login      email                        password                      Return a bearer token')
+    print('resume                                                                Resume last interrupted multipart upload')
+    print('resume-download                                                       Resume last interrupted download')
+    print('upload-dir local/folder                 path/in/S3                    Upload all the files of a folder')
+    print('download-dir path/in/S3                 local/folder                  Download all the data of a subfolder')
+    print('sync       local/folder|path/in/S3      path/in/S3|local/folder       Transfer only new or changed files')
+    print('Options:')
+    print('--limit-rate RATE                                                     Bytes per second shared by all the transfers (e.g. 10M)')
+    print('--transfer-limit-rate RATE                                            Bytes per second of each transfer')
+    print('--priority N                                                          Share of the bandwidth of the transfers, 2 gets twice 1')
+    return 2
+
+
+###############################################
+# Error raised instead of terminating the     #
+# process, the command line prints it         #
+###############################################
+class MaapS3Error(Exception):
+    pass
+
+
+#A part or a segment that failed in a way worth trying again (incomplete, corrupted)
+class RetryableError(IOError):
+    pass
+
+
+#A request answered with an error status
+class StatusError(IOError):
+    def __init__(self, status, what):
+        IOError.__init__(self, what +" failed with status "+ str(status))
+        self.status = status
+
+
+###############################################
+# HTTP client shared by all the commands, the #
+# connections to the iam, the gateway and the #
+# S3 are kept alive and reused                #
+###############################################
+class HttpClient:
+    def __init__(self, pool_size=MAAP_S3_WORKERS, retries=MAAP_S3_HTTP_RETRIES):
+        #Only requests that never reached the server are retried here, the error statuses
+        #are left to RetryPolicy so a request is not sent again by both
+        retry = Retry(total=retries, connect=retries, read=0, status=0, backoff_factor=0.5,
+                      raise_on_status=False)
+        #One pool per host, each one sized for the transfer workers plus the gateway calls
+        self.adapter = requests.adapters.HTTPAdapter(pool_connections=8, pool_maxsize=pool_size + 2, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+
+    def request(self, method, url, **kwargs):
+        return self.session.request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request('PUT', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+    #Number of connections (TCP and TLS handshakes) opened so far
+    def connections(self):
+        pools = self.adapter.poolmanager.pools
+        return sum(pools[key].num_connections for key in pools.keys())
+
+
+def get_client():
+    global client
+    with client_lock:
+        if client is None:
+            client = HttpClient()
+    return client
+
+
+#########################
+# Init the bearer       #
+#########################
+def init():
+
+        
+    if TOKENS.token or os.path.isfile(USER_INFO_FILE_PATH):
+        print("[INFO] Personal user info is find")
+        #The token is generated again when it is about to expire
+        TOKENS.get()
+
+    else:
+        print("[INFO] Personal user info is not found")
+        refresh()
+
+
+###########################
+# Refresh token and save #
+###########################
+def refresh():
+    email = input("Your email: ")
+    #password
+    password = input("Your password: ")           
+    #Function to generate a new token
+    generate_token(email, password)
+
+
+###################################
+# Login using email dans password #
+###################################
+def login(email, password):
+    if email and password:
+        print("[INFO] Get an existing or fresh token")         
+        #Function to generate a new token
+        generate_token(email, password)
+    else:
+        print("[ERROR] Please check your email or password") 
+
+###########################
+# Generate token and save #
+###########################
+def generate_token(email, password): 
+        
+    print("[INFO] Start retrieving token for authent")
+    #Set the bearer
+    url = "https://iam."+MAAP_ENV_TYPE.lower()+".esa-maap.org/oxauth/restv1/token"
+    print (url)
+    print (CLIENT_ID)
+    response = get_client().post(url, data={'client_id': CLIENT_ID, 'username': email, 'password': password, "grant_type": "password", "scope": "openid+profile"})
+    print(response)
+    #Convert the string to json to fecth access_token
+    data = json.loads(response.text)
+    token = data['access_token']
+    #Expiry from the token itself, or from the lifetime given by the iam
+    expiresAt = token_expiry(token, time.time() + data.get('expires_in', TOKEN_LIFETIME))
+
+    # add the token in the json info file
+    #Create a json with email and password
+    userinfo = {
+        'email': email,
+        'password': password,
+        'token': token,
+        'expiresAt': expiresAt
+    }
+
+    if token: 
+        #add the json in the file
+        with open(USER_INFO_FILE_PATH, 'w') as outfile:
+            json.dump(userinfo, outfile)
+        TOKENS.set(email, password, token, expiresAt)
+           
+        print("[INFO] Token saved until "+ time.ctime(expiresAt) +" and ready to be used "+token)
+        return token
+        
+    else:
+        print("[ERROR] Token is empty. Please 1) run refresh (-r) function and check your password")
+        raise MaapS3Error("Token is empty")
+
+
+################################
+# Generate token and return it #
+###############################
+def get_token(email, password): 
+        
+    #print("[INFO] Start retrieving token for authent")
+    #Set the bearer
+    url = "https://iam."+MAAP_ENV_TYPE.lower()+".esa-maap.org/oxauth/restv1/token"
+    response = get_client().post(url, data={'client_id': CLIENT_ID, 'username': email, 'password': password, "grant_type": "password", "scope": "openid+profile"})
+    #Convert the string to json to fecth access_token
+    data = json.loads(response.text)
+    token = data['access_token']
+    print (token)
+    return token
+
+
+
+#######################################################
+# Token kept in memory for the life of the process,   #
+# generated again a few minutes before it expires     #
+#######################################################
+class TokenManager:
+    def __init__(self, margin=TOKEN_REFRESH_MARGIN):
+        self.margin = margin
+        self.email = None
+        self.password = None
+        self.token = None
+        self.expiresAt = 0
+        self.lock = threading.RLock()
+
+    def set(self, email, password, token, expiresAt):
+        with self.lock:
+            self.email = email
+            self.password = password
+            self.token = token
+            self.expiresAt = expiresAt
+
+    #Read the user info file once
+    def load(self):
+        with open(USER_INFO_FILE_PATH) as json_file:
+            userinfo = json.load(json_file)
+        #Files written by older versions have no expiry, the token lasted one hour
+        expiresAt = userinfo.get('expiresAt') or token_expiry(userinfo.get('token'), path.getmtime(USER_INFO_FILE_PATH) + TOKEN_LIFETIME)
+        self.set(userinfo['email'], userinfo['password'], userinfo.get('token'), expiresAt)
+
+    def get(self):
+        with self.lock:
+            #Credentials given to a Client are used before the user info file
+            if self.token is None and self.email is None:
+                if not os.path.isfile(USER_INFO_FILE_PATH):
+                    refresh()
+                else:
+                    self.load()
+            if not self.token or time.time() > self.expiresAt - self.margin:
+                print("[INFO] Token is expired, we generate a new one")
+                generate_token(self.email, self.password)
+            return self.token
+
+    #Generate a new token after the gateway rejected the given one,
+    #unless another worker already did it
+    def refresh(self, rejected):
+        with self.lock:
+            if self.token == rejected:
+                print("[INFO] Token rejected, we generate a new one")
+                generate_token(self.email, self.password)
+            return self.token
+
+
+TOKENS = TokenManager()
+
+
+##################################################
+# Expiry date of a JWT token from its exp claim, #
+# the default is returned for opaque tokens      #
+##################################################
+def token_expiry(token, default):
+    try:
+        payload = token.split('.')[1]
+        payload += '=' * (-len(payload) % 4)
+        return float(json.loads(base64.urlsafe_b64decode(payload))['exp'])
+    except Exception:
+        return default
+
+
+#########################################
+# Url of the S3 api of the gateway      #
+#########################################
+def gateway_url(path):
+    return "https://gravitee-gateway."+MAAP_ENV_TYPE.lower()+".esa-maap.org/s3/"+path
+
+
+##################################################
+# Call the gateway with the current token, a     #
+# rejected token is generated again once         #
+##################################################
+def gateway_request(method, path, **kwargs):
+    token = TOKENS.get()
+    response = get_client().request(method, gateway_url(path), headers = {'Authorization': 'Bearer '+token}, **kwargs)
+    if response.status_code == 401:
+        token = TOKENS.refresh(token)
+        response = get_client().request(method, gateway_url(path), headers = {'Authorization': 'Bearer '+token}, **kwargs)
+    return response
+
+
+#####################################################
+# Send a part or a segment again after a transient #
+# failure, waiting longer after each attempt. The  #
+# other parts go on while one is retried           #
+#####################################################
+class RetryPolicy:
+    def __init__(self, attempts=MAAP_S3_RETRIES, base=MAAP_S3_RETRY_BASE, cap=MAAP_S3_RETRY_CAP, statuses=RETRYABLE_STATUS):
+        self.attempts = attempts
+        self.base = base
+        self.cap = cap
+        self.statuses = statuses
+
+    #Connection resets, timeouts, corrupted data and the statuses of a busy or failing server
+    def retryable(self, error, statuses=(), transient=()):
+        if isinstance(error, RetryableError) or isinstance(error, transient):
+            return True
+        if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout, requests.exceptions.ChunkedEncodingError)):
+            return True
+        status = getattr(error, 'status', None)
+        if isinstance(error, requests.exceptions.HTTPError) and error.response is not None:
+            status = error.response.status_code
+        return status in self.statuses or status in statuses
+
+    #Full jitter: the workers retrying at once do not hit the server together again
+    def delay(self, attempt):
+        return random.uniform(0, min(self.cap, self.base * 2 ** attempt))
+
+    #Seconds to wait before the next attempt, the error is raised when it is not worth retrying
+    def wait(self, error, attempt, what, metrics, latency, statuses=(), transient=()):
+        if attempt >= self.attempts or not self.retryable(error, statuses, transient):
+            raise error
+        wait = self.delay(attempt)
+        print("[INFO] "+ what +" failed ("+ str(error) +"), attempt "+ str(attempt + 1) +" in %.1fs" % wait)
+        if metrics:
+            metrics.retry(what, error, latency, wait)
+        return wait
+
+    #Call send until it returns, statuses are retried on top of the usual ones
+    def run(self, send, what, metrics=None, statuses=()):
+        attempt = 1
+        while True:
+            start = time.time()
+            try:
+                return send()
+            except Exception as e:
+                time.sleep(self.wait(e, attempt, what, metrics, time.time() - start, statuses))
+            attempt += 1
+
+    async def run_async(self, send, what, metrics=None, statuses=(), transient=()):
+        attempt = 1
+        while True:
+            start = time.time()
+            try:
+                return await send()
+            except Exception as e:
+                await asyncio.sleep(self.wait(e, attempt, what, metrics, time.time() - start, statuses, transient))
+            attempt += 1
+
+
+RETRIES = RetryPolicy()
+
+
+##################################################
+# Token bucket limiting the bytes per second of  #
+# a transfer, a rate of 0 means unlimited        #
+##################################################
+class TokenBucket:
+    def __init__(self, rate=0):
+        self.rate = rate
+        self.tokens = 0
+        self.last = time.time()
+        self.lock = threading.Lock()
+
+    def set_rate(self, rate):
+        with self.lock:
+            self.rate = rate
+            self.tokens = min(self.tokens, rate)
+
+    #Take nbBytes from the bucket and return the seconds to wait for the missing tokens
+    def reserve(self, nbBytes):
+        with self.lock:
+            if not self.rate:
+                return 0
+            now = time.time()
+            #At most one second of traffic can be sent in a burst
+            self.tokens = min(self.tokens + (now - self.last) * self.rate, self.rate)
+            self.last = now
+            self.tokens -= nbBytes
+            return max(-self.tokens / self.rate, 0)
+
+    def consume(self, nbBytes):
+        wait = self.reserve(nbBytes)
+        if wait > 0:
+            time.sleep(wait)
+
+
+######################################################
+# Share the global bandwidth between the transfers  #
+# in progress according to their priority, a       #
+# transfer never goes above the per-transfer limit  #
+######################################################
+class BandwidthScheduler:
+    def __init__(self, rate=0, transfer_rate=0):
+        self.rate = rate
+        self.transfer_rate = transfer_rate
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def configure(self, rate=None, transfer_rate=None):
+        with self.lock:
+            if rate is not None:
+                self.rate = rate
+            if transfer_rate is not None:
+                self.transfer_rate = transfer_rate
+            self.rebalance()
+
+    #Return the bucket of a new transfer, a priority of 2 gets twice the share of 1
+    def register(self, priority=1):
+        bucket = TokenBucket()
+        with self.lock:
+            self.buckets[bucket] = max(priority, 1)
+            self.rebalance()
+        return bucket
+
+    def unregister(self, bucket):
+        with self.lock:
+            self.buckets.pop(bucket, None)
+            self.rebalance()
+
+    #Weighted fair share, the bandwidth left by the transfers held
+    #at the per-transfer limit goes to the others
+    def rebalance(self):
+        if not self.rate:
+            for bucket in self.buckets:
+                bucket.set_rate(self.transfer_rate)
+            return
+        pending = dict(self.buckets)
+        remaining = self.rate
+        while pending:
+            total = sum(pending.values())
+            capped = [bucket for bucket, priority in pending.items()
+                      if self.transfer_rate and remaining * priority / total >= self.transfer_rate]
+            if not capped:
+                for bucket, priority in pending.items():
+                    bucket.set_rate(remaining * priority / total)
+                return
+            for bucket in capped:
+                bucket.set_rate(self.transfer_rate)
+                remaining -= self.transfer_rate
+                del pending[bucket]
+
+
+######################################################
+# Parse a rate in bytes per second, K, M and G      #
+# suffixes are accepted (10M is 10 MiB per second)  #
+######################################################
+def parse_rate(value):
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    value = str(value).strip().upper().rstrip('B')
+    if not value:
+        return 0
+    if value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(float(value))
+
+
+BANDWIDTH = BandwidthScheduler(parse_rate(MAAP_S3_BANDWIDTH), parse_rate(MAAP_S3_TRANSFER_BANDWIDTH))
+
+
+##############################################
+# Progress and metrics of a transfer, events #
+# are appended to the json lines transfer log #
+##############################################
+class TransferMetrics:
+    def __init__(self, operation, source, destination, totalBytes, report_every=2, priority=None):
+        self.operation = operation
+        self.source = source
+        self.destination = destination
+        self.totalBytes = totalBytes
+        self.report_every = report_every
+        self.transferred = 0
+        self.parts = 0
+        self.retries = 0
+        self.histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.start = time.time()
+        self.last_report = self.start
+        self.connections = get_client().connections()
+        self.lock = threading.Lock()
+        self.priority = MAAP_S3_PRIORITY if priority is None else priority
+        self.throttle = BANDWIDTH.register(self.priority)
+        self.log('start', totalBytes=totalBytes, priority=self.priority)
+
+    def elapsed(self):
+        return max(time.time() - self.start, 1e-6)
+
+    def rate(self):
+        return self.transferred / self.elapsed()
+
+    def eta(self):
+        rate = self.rate()
+        if rate <= 0:
+            return None
+        return (self.totalBytes - self.transferred) / rate
+
+    #Count transferred bytes and print the progress from time to time
+    def add_bytes(self, nbBytes):
+        with self.lock:
+            self.transferred += nbBytes
+            now = time.time()
+            if now - self.last_report < self.report_every and self.transferred < self.totalBytes:
+                return
+            self.last_report = now
+            percent = 100.0 * self.transferred / self.totalBytes if self.totalBytes else 100.0
+            eta = self.eta()
+            print("[INFO] %.1f%% %.2f MB/s ETA %s" % (percent, self.rate() / 1e6, "%ds" % eta if eta is not None else "n/a"))
+
+    #Record a finished part and its latency
+    def part_done(self, partNumber, size, latency):
+        with self.lock:
+            self.parts += 1
+            bucket = len(LATENCY_BUCKETS)
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if latency <= bound:
+                    bucket = i
+                    break
+            self.histogram[bucket] += 1
+        self.log('part', partNumber=partNumber, size=size, latency=round(latency, 4))
+
+    #Record a failed attempt of a part, sent again after wait seconds
+    def retry(self, what, error, latency, wait):
+        with self.lock:
+            self.retries += 1
+        self.log('retry', what=what, error=str(error), latency=round(latency, 4), wait=round(wait, 3))
+
+    def latency_histogram(self):
+        bounds = [str(bound) for bound in LATENCY_BUCKETS] + ['+Inf']
+        return dict(zip(bounds, self.histogram))
+
+    #Write the summary of the transfer
+    def close(self, status='success'):
+        BANDWIDTH.unregister(self.throttle)
+        self.log('end', status=status, transferred=self.transferred, parts=self.parts, retries=self.retries,
+                 seconds=round(self.elapsed(), 3), bytesPerSecond=round(self.rate(), 1),
+                 newConnections=get_client().connections() - self.connections,
+                 latencyHistogram=self.latency_histogram())
+
+    def log(self, event, **fields):
+        if not TRANSFER_LOG_FILE_PATH:
+            return
+        record = {'time': time.time(), 'event': event, 'operation': self.operation,
+                  'source': self.source, 'destination': self.destination}
+        record.update(fields)
+        with self.lock:
+            with open(TRANSFER_LOG_FILE_PATH, 'a') as logfile:
+                logfile.write(json.dumps(record) + "\n")
+
+
+###################################################
+# File wrapper streamed by requests that waits    #
+# for the bandwidth of the transfer before each   #
+# block is sent                                   #
+###################################################
+class ThrottledReader:
+    def __init__(self, f, size, throttle=None):
+        self.f = f
+        self.size = size
+        self.throttle = throttle
+
+    def __len__(self):
+        return self.size
+
+    def read(self, size=-1):
+        chunk = self.f.read(size)
+        if self.throttle:
+            self.throttle.consume(len(chunk))
+        return chunk
+
+
+###################################################
+# Throttled file wrapper that also reports the    #
+# bytes read to the transfer metrics              #
+###################################################
+class ProgressReader(ThrottledReader):
+    def __init__(self, f, size, metrics, checksum=None):
+        ThrottledReader.__init__(self, f, size, metrics.throttle)
+        self.metrics = metrics
+        self.checksum = checksum
+        self.count = 0
+
+    def read(self, size=-1):
+        chunk = ThrottledReader.read(self, size)
+        self.count += len(chunk)
+        self.metrics.add_bytes(len(chunk))
+        if self.checksum:
+            self.checksum.update(chunk)
+        return chunk
+
+
+#####################################################
+# MD5 of a stream, for the whole data and for each  #
+# block, computed on the buffers already in memory  #
+#####################################################
+class StreamChecksum:
+    def __init__(self, block_size):
+        self.block_size = block_size
+        self.md5 = hashlib.md5()
+        self.block = hashlib.md5()
+        self.blockFill = 0
+        self.blocks = []
+
+    def update(self, data):
+        self.md5.update(data)
+        view = memoryview(data)
+        while len(view):
+            take = min(self.block_size - self.blockFill, len(view))
+            self.block.update(view[:take])
+            self.blockFill += take
+            view = view[take:]
+            if self.blockFill == self.block_size:
+                self.blocks.append(self.block.hexdigest())
+                self.block = hashlib.md5()
+                self.blockFill = 0
+
+    def parts(self):
+        if self.blockFill:
+            return self.blocks + [self.block.hexdigest()]
+        return self.blocks[:]
+
+
+##################################################
+# Checksum manifest of an upload: the size, the  #
+# MD5 of each part and the ETag the S3 gives to  #
+# the object                                     #
+##################################################
+def make_manifest(fileSize, partSize, partMd5s, md5=None):
+    if md5 is None:
+        #ETag of a multipart upload: MD5 of the part MD5s and the number of parts
+        md5 = hashlib.md5(b''.join(binascii.unhexlify(partMd5) for partMd5 in partMd5s)).hexdigest() + '-' + str(len(partMd5s))
+    return {'size': fileSize, 'eTag': md5, 'partSize': partSize, 'parts': partMd5s}
+
+
+def upload_manifest(destination, manifest):
+    if not MAAP_S3_MANIFEST:
+        return
+    response = gateway_request('PUT', destination + MANIFEST_SUFFIX, allow_redirects=False)
+    location = response.headers.get('Location')
+    if location:
+        response = get_client().put(location, data=json.dumps(manifest).encode())
+    if not response.ok:
+        print("[ERROR] The checksum manifest of "+ destination +" could not be saved")
+
+
+#######################################################
+# Manifest of an object, None when there is none or   #
+# when it was written for another version of the data #
+#######################################################
+def fetch_manifest(path, eTag):
+    #Only the multipart uploads have one, their ETag ends with the number of parts
+    if not has_manifest(eTag):
+        return None
+    response = gateway_request('GET', path + MANIFEST_SUFFIX, allow_redirects=False)
+    location = response.headers.get('Location')
+    if not location:
+        return None
+    response = get_client().get(location)
+    if not response.ok:
+        return None
+    try:
+        manifest = response.json()
+    except ValueError:
+        return None
+    if not eTag or manifest.get('eTag') != eTag.strip('"'):
+        print("[INFO] The checksum manifest does not match the data, it will not be verified")
+        return None
+    return manifest
+
+
+#ETag of an object uploaded in parts, the ones with a manifest
+def has_manifest(eTag):
+    return bool(eTag) and '-' in eTag
+
+
+#Delete the manifest of an object, an object uploaded in one request has none
+def delete_manifest(key):
+    try:
+        delete_object(key + MANIFEST_SUFFIX, manifest=False)
+    except IOError:
+        pass
+
+
+########################################################
+# Check the ETag of a part against its MD5, only when  #
+# MAAP_S3_VERIFY_ETAG is set: with KMS encryption the  #
+# ETag looks like a MD5 but is not the one of the data #
+########################################################
+def check_etag(etag, md5, what):
+    if not MAAP_S3_VERIFY_ETAG:
+        return
+    etag = etag.strip('"')
+    if len(etag) == 32 and all(c in '0123456789abcdef' for c in etag.lower()) and etag.lower() != md5:
+        raise RetryableError("Checksum mismatch for "+ what +": ETag "+ etag +" instead of "+ md5)
+
+
+#######################################################
+# Content-MD5 header of a data sent to a presigned    #
+# url, the S3 checks the data against it. It is only  #
+# sent to signature v4 urls: v2 urls sign the header, #
+# adding it would get a 403                           #
+#######################################################
+def md5_headers(presignedUrl, digest):
+    if any(name.startswith('X-Amz-') for name in parse_qs(urlparse(presignedUrl).query)):
+        return {'Content-MD5': base64.b64encode(digest).decode()}
+    return {}
+
+
+#########################
+# Upload the data in S3 #
+#########################
+def upload(sourceFile, destination):
+    print("[INFO] Source file is : ", sourceFile)
+    print("[INFO] Destination file is : ", destination) 
+
+    if sourceFile and destination:
+        print("[INFO] Get an existing or fresh token")
+        #Generate or get a token
+        init()
+        upload_file(sourceFile, destination)
+
+    else:
+        display_help()
+
+
+###########################################
+# Upload one file, the token is available #
+###########################################
+def upload_file(sourceFile, destination, journal=True):
+    #The cached listings of the destination folder are no longer right
+    LISTINGS.invalidate(destination)
+    # If the file is less than the threshold we upload directly
+    #Check file size
+    fileSize = os.stat(sourceFile).st_size
+    print("Size "+ str(fileSize))
+
+    #We have more than the multipart threshold
+    if fileSize > MAAP_S3_MULTIPART_THRESHOLD:
+        #We upload the multi part data
+        print("[INFO] Starting multi part upload")
+        upload_multipart(sourceFile, destination, journal=journal)
+
+    else: 
+
+        print("[INFO] Starting retrieving the presigned url for the creation of the file")
+        #files = {'upload_file': open(sourceFile,'rb')}
+        response = gateway_request('PUT', destination, allow_redirects=False)
+        location = response.headers['Location']
+        print("[INFO] Location is "+ location)
+
+        if location:
+            print("[INFO] Start uploading the file")
+            metrics = TransferMetrics('upload', sourceFile, destination, fileSize)
+
+            def send():
+                #The checksum is computed on the buffers sent, the file is read once per attempt
+                checksum = StreamChecksum(MAAP_S3_SEGMENT_SIZE)
+                with TRANSFER_SLOTS:
+                    with open(sourceFile, 'rb') as f:
+                        reader = ProgressReader(f, fileSize, metrics, checksum)
+                        try:
+                            response = get_client().put(location, data=reader)
+                            print(response)
+                            response.raise_for_status()
+                            check_etag(response.headers.get('ETag', ''), checksum.md5.hexdigest(), sourceFile)
+                        except Exception:
+                            #The bytes of a failed attempt are sent again
+                            metrics.add_bytes(-reader.count)
+                            raise
+                return checksum
+
+            start = time.time()
+            try:
+                checksum = RETRIES.run(send, sourceFile, metrics)
+            except Exception:
+                metrics.close('failed')
+                raise
+            metrics.part_done(1, fileSize, time.time() - start)
+            metrics.close()
+            #files = {'file': open(sourceFile, 'rb')}
+            #r = requests.put(location, files=files)
+            
+        else:
+            print("[ERROR] Presigned url not generated. Please re run refresh or contact admin if the error persist")
+
+
+
+###########################################################
+# Upload the data in S3, the data is split chunk by chunk #
+###########################################################
+def upload_multipart(sourceFile, destination, workers=MAAP_S3_WORKERS, journal=True):
+
+
+    #Set variables
+    filePath = sourceFile
+    key = destination
+
+    #The size and date of the file are kept in the journal, resume checks the file did not change
+    fileStat = os.stat(filePath)
+    fileSize = fileStat.st_size
+    print("Size "+ str(fileSize))
+    #Choose the part size from the file size
+    max_size, nbParts = plan_parts(fileSize, workers=workers)
+    print("[INFO] We will have "+ str(nbParts)+" parts of "+ str(max_size) +" bytes uploaded by "+ str(workers) +" workers")
+            
+    
+    params={'bucketName': 'bmap-catalogue-data', 'objectKey': key}
+    response = gateway_request('GET', 'generateUploadId', params = params)
+ 
+    print("[INFO] uploadId "+ response.text)
+    #Save upload id
+    uploadId = response.text
+
+    #Presigned urls are generated window by window while the parts are sent
+    presignedUrls = PresignedUrlProvider(key, uploadId, nbParts)
+
+    # we load the data, each worker reads its own part by offset
+    metrics = TransferMetrics('upload_multipart', sourceFile, destination, fileSize)
+    partMd5s = {}
+    try:
+        parts = upload_parts(sourceFile, destination, uploadId, presignedUrls, range(1, nbParts+1), fileSize, max_size, [], workers, metrics, journal, partMd5s, fileStat.st_mtime)
+
+        #complete the multi part
+        params={'bucketName': 'bmap-catalogue-data', 'objectKey': key, 'nbParts': nbParts, 'uploadId': uploadId}
+        response = gateway_request('GET', 'completeMultiPartUploadRequest', data=str(parts),  params = params)
+        response.raise_for_status()
+    except Exception:
+        #The parts already sent are still on the S3, the journal is kept so resume can complete the upload
+        metrics.close('failed')
+        raise
+    metrics.close()
+    upload_manifest(destination, make_manifest(fileSize, max_size, [partMd5s[partNumber] for partNumber in sorted(partMd5s)]))
+    #delete the file of multipart info because upload was success
+    if journal:
+        os.remove(USER_LAST_UPLOAD_INFO_FILE_PATH) 
+
+
+#####################################################
+# Upload a list of parts in parallel and return the #
+# ordered list of parts for the completion request  #
+#####################################################
+def upload_parts(sourceFile, destination, uploadId, presignedUrls, partNumbers, fileSize, max_size, partsUpploaded, workers=MAAP_S3_WORKERS, metrics=None, journal=True, partMd5s=None, mtime=None):
+    lock = threading.Lock()
+    parts = {part['partNumber']: part['eTag'] for part in partsUpploaded}
+    #MD5 of each part, filled for the parts sent
+    partMd5s = {} if partMd5s is None else partMd5s
+
+    #The parts are sent from slices of a map of the file, they are not copied in memory
+    source = map_file(sourceFile)
+
+    def upload_part(partNumber):
+        #Only the bytes of this part
+        offset = (partNumber-1) * max_size
+        size = min(max_size, fileSize - offset)
+        with memoryview(source)[offset:offset + size] as view:
+            #The S3 checks the part against its MD5
+            digest = hashlib.md5(view).digest()
+            throttle = metrics.throttle if metrics else None
+            print("Upload part "+ str(partNumber))
+
+            def send():
+                presignedUrl = presignedUrls.get(partNumber)
+                headers = md5_headers(presignedUrl, digest)
+                headers['Content-Length'] = str(size)
+                with TRANSFER_SLOTS:
+                    response = get_client().put(presignedUrl, data=ThrottledReader(FileSlice(view), size, throttle), headers=headers)
+                if response.status_code == 403:
+                    #The url expired before its part was sent, the next attempt gets a new one
+                    presignedUrls.expire(partNumber)
+                response.raise_for_status()
+                etag = response.headers['ETag']
+                check_etag(etag, binascii.hexlify(digest).decode(), "part "+ str(partNumber))
+                return etag
+
+            start = time.time()
+            etag = RETRIES.run(send, "Part "+ str(partNumber), metrics, statuses=(403,))
+        release_pages(source, offset, size)
+        if metrics:
+            metrics.part_done(partNumber, size, time.time() - start)
+            metrics.add_bytes(size)
+
+        with lock:
+            parts[partNumber] = etag
+            partMd5s[partNumber] = binascii.hexlify(digest).decode()
+            if journal:
+                save_upload_journal(uploadId, parts, sourceFile, destination, max_size, fileSize, partMd5s, mtime)
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(upload_part, partNumber) for partNumber in partNumbers]
+            for future in as_completed(futures):
+                #Raise the first error, the parts already sent are kept for resume
+                future.result()
+    finally:
+        source.close()
+
+    return ordered_parts(parts)
+
+
+###################################################
+# Read only map of a file, the parts are taken as #
+# memoryview slices of it without a copy          #
+###################################################
+def map_file(sourceFile):
+    with open(sourceFile, 'rb') as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+#Close a map of a file, a view still used by a cancelled read keeps it open until it is released
+def close_map(source):
+    try:
+        source.close()
+    except BufferError:
+        pass
+
+
+#Drop the pages of a part already sent so the memory stays flat (Python 3.8+)
+def release_pages(source, offset, size):
+    if hasattr(source, 'madvise') and hasattr(mmap, 'MADV_DONTNEED') and offset % mmap.PAGESIZE == 0:
+        source.madvise(mmap.MADV_DONTNEED, offset, size)
+
+
+###################################################
+# Part of a mapped file streamed by requests, it  #
+# copies only the small blocks being sent         #
+###################################################
+class FileSlice:
+    def __init__(self, view):
+        self.view = view
+        self.position = 0
+
+    def __len__(self):
+        return len(self.view)
+
+    def read(self, size=-1):
+        end = len(self.view) if size is None or size < 0 else min(self.position + size, len(self.view))
+        chunk = self.view[self.position:end].tobytes()
+        self.position = end
+        return chunk
+
+
+JOURNAL_LOCK = threading.Lock()
+
+
+####################################################
+# Save the parts sent of a multipart upload so we  #
+# can resume it if the upload failed               #
+####################################################
+def save_upload_journal(uploadId, parts, sourceFile, destination, max_size, fileSize, partMd5s, mtime=None):
+    multipartinfo = {
+        'uploadId': uploadId,
+        'partsUpploaded': ordered_parts(parts),
+        'sourceFile': sourceFile,
+        'destination': destination,
+        'fileSize': fileSize,
+        'mtime': os.stat(sourceFile).st_mtime if mtime is None else mtime,
+        'partSize': max_size,
+        'nbParts': math.ceil(fileSize/max_size),
+        'partMd5s': partMd5s
+    }
+    #add the json in the file, the asyncio backend writes it from several threads
+    with JOURNAL_LOCK:
+        with open(USER_LAST_UPLOAD_INFO_FILE_PATH, 'w') as outfile:
+            json.dump(multipartinfo, outfile)
+
+
+###############################################
+# Choose the part size of a multipart upload  #
+# from the file size, the target number of    #
+# parts and the memory used by the workers    #
+###############################################
+def plan_parts(fileSize, target_parts=MAAP_S3_TARGET_PARTS, memory_budget=MAAP_S3_MEMORY_BUDGET, workers=MAAP_S3_WORKERS):
+    mib = 1024 * 1024
+    #Smallest part size that keeps the upload under the S3 part limit
+    min_size = max(S3_MIN_PART_SIZE, math.ceil(fileSize/S3_MAX_PARTS))
+    #Part size giving the target number of parts
+    part_size = max(min_size, math.ceil(fileSize/max(target_parts, 1)))
+    #Each worker holds one part in memory
+    part_size = min(part_size, max(min_size, memory_budget // max(workers, 1)))
+    #Round up to a whole MiB
+    part_size = min(math.ceil(part_size/mib) * mib, S3_MAX_PART_SIZE)
+    nbParts = max(math.ceil(fileSize/part_size), 1)
+    return part_size, nbParts
+
+
+###################################################
+# Presigned urls of a multipart upload, fetched   #
+# a window ahead of the workers and fetched again #
+# when they are about to expire. The window       #
+# doubles at each call                            #
+###################################################
+class PresignedUrlProvider:
+    def __init__(self, destination, uploadId, nbParts, window=MAAP_S3_URL_WINDOW):
+        self.destination = destination
+        self.uploadId = uploadId
+        self.nbParts = nbParts
+        self.window = window
+        #partNumber -> (url, time after which the url is considered expired)
+        self.urls = {}
+        self.lock = threading.Lock()
+
+    def get(self, partNumber):
+        with self.lock:
+            if not self.valid(partNumber):
+                self.fetch(partNumber)
+            #Keep half a window ready ahead of the workers
+            ahead = min(partNumber + self.window // 2, self.nbParts)
+            if not self.valid(ahead):
+                self.fetch(ahead)
+            return self.urls[partNumber][0]
+
+    def expire(self, partNumber):
+        with self.lock:
+            self.urls.pop(partNumber, None)
+
+    def valid(self, partNumber):
+        return partNumber in self.urls and self.urls[partNumber][1] > time.time()
+
+    #Fetch a window of urls starting at the given part. The gateway has no range and signs
+    #the urls of the parts 1 to nbParts: all of them are kept, and doubling the window
+    #bounds the urls signed by an upload to about twice its number of parts
+    def fetch(self, partNumber):
+        last = min(partNumber + self.window - 1, self.nbParts)
+        self.window *= 2
+        params={'bucketName': 'bmap-catalogue-data', 'objectKey': self.destination, 'nbParts': last, 'uploadId': self.uploadId}
+        fetched = time.time()
+        response = gateway_request('GET', 'generateListPresignedUrls', params = params)
+        response.raise_for_status()
+        listPresignedUrl = response.json()
+        if len(listPresignedUrl) < last:
+            raise IOError("The gateway returned "+ str(len(listPresignedUrl)) +" presigned urls instead of "+ str(last))
+        print("[INFO] Presigned urls of the parts 1 to "+ str(last) +" generated")
+        for number in range(1, last + 1):
+            presignedUrl = listPresignedUrl[number - 1]
+            self.urls[number] = (presignedUrl, fetched + url_lifetime(presignedUrl) - PRESIGNED_URL_MARGIN)
+
+
+######################################################
+# Lifetime in seconds of a presigned url, read from  #
+# its signature parameters                           #
+######################################################
+def url_lifetime(presignedUrl):
+    query = parse_qs(urlparse(presignedUrl).query)
+    if 'X-Amz-Expires' in query:
+        return int(query['X-Amz-Expires'][0])
+    if 'Expires' in query:
+        #Signature v2 gives the expiry date
+        return int(query['Expires'][0]) - time.time()
+    return PRESIGNED_URL_LIFETIME
+
+
+#########################################
+# Return the parts sorted by part number #
+#########################################
+def ordered_parts(parts):
+    return [{'eTag': parts[partNumber], 'partNumber': partNumber} for partNumber in sorted(parts)]
+
+
+
+
+###################################
+# Resume failed multi part upload #
+###################################
+def resume(workers=MAAP_S3_WORKERS):
+    print("[INFO] Resume the last multipart upload")
+    print("[INFO] Check last multipart upload metadata")
+
+    if os.path.isfile(USER_LAST_UPLOAD_INFO_FILE_PATH):
+        
+        #Generate or get a token
+        init()
+        print("[INFO] Previous multi part upload file found")
+        
+        #Get the data in the json file
+        with open(USER_LAST_UPLOAD_INFO_FILE_PATH) as json_file:
+            multipartinfo = json.load(json_file)
+        #Get the info
+        uploadId=multipartinfo['uploadId']
+        destination=multipartinfo['destination']
+        sourceFile=multipartinfo['sourceFile']
+        partsUpploaded=multipartinfo['partsUpploaded']
+        
+        fileStat = os.stat(sourceFile)
+        fileSize = fileStat.st_size
+        print("Size "+ str(fileSize))
+        #Reuse the part layout of the interrupted upload, older uploads used 5M
+        max_size = multipartinfo.get('partSize', S3_MIN_PART_SIZE)
+        nbParts = multipartinfo.get('nbParts', math.ceil(fileSize/max_size))
+
+        #The parts already sent are from another content when the file changed, start again
+        #(older journals have no size nor date, the number of parts is checked)
+        if fileSize != multipartinfo.get('fileSize', fileSize) or fileStat.st_mtime != multipartinfo.get('mtime', fileStat.st_mtime) or nbParts != math.ceil(fileSize/max_size):
+            print("[INFO] The file changed since the last upload, upload it again")
+            upload_multipart(sourceFile, destination, workers)
+            print("[INFO] Upload completed")
+            return
+
+        #Keep only the parts of this layout that have an ETag
+        uploaded = {part['partNumber']: part['eTag'] for part in partsUpploaded if part.get('eTag') and 1 <= part['partNumber'] <= nbParts}
+        missing = [partNumber for partNumber in range(1, nbParts+1) if partNumber not in uploaded]
+        print("[INFO] We have "+ str(nbParts)+" parts, "+ str(len(uploaded)) +" already uploaded. We have to push "+ str(len(missing)) +" parts")
+
+        #Presigned urls are generated window by window while the parts are sent
+        presignedUrls = PresignedUrlProvider(destination, uploadId, nbParts)
+
+        #we push only the missing parts
+        #json keys are strings, the MD5 of older uploads is their ETag
+        partMd5s = {int(partNumber): md5 for partNumber, md5 in multipartinfo.get('partMd5s', {}).items()}
+        for partNumber in uploaded:
+            partMd5s.setdefault(partNumber, uploaded[partNumber].strip('"'))
+        metrics = TransferMetrics('resume', sourceFile, destination, fileSize)
+        try:
+            metrics.add_bytes(sum(min(max_size, fileSize - (partNumber-1) * max_size) for partNumber in uploaded))
+            parts = upload_parts(sourceFile, destination, uploadId, presignedUrls, missing, fileSize, max_size, ordered_parts(uploaded), workers, metrics, partMd5s=partMd5s, mtime=fileStat.st_mtime)
+
+            #complete the multi part
+            params={'bucketName': 'bmap-catalogue-data', 'objectKey': destination, 'nbParts': nbParts, 'uploadId': uploadId}
+            response = gateway_request('GET', 'completeMultiPartUploadRequest', data=str(parts),  params = params)
+            response.raise_for_status()
+        except Exception:
+            metrics.close('failed')
+            raise
+        metrics.close()
+        upload_manifest(destination, make_manifest(fileSize, max_size, [partMd5s[partNumber] for partNumber in range(1, nbParts+1)]))
+        #delete the file of multipart info because upload was success
+        os.remove(USER_LAST_UPLOAD_INFO_FILE_PATH) 
+        print("[INFO] Upload resumed and completed")
+    
+    else:
+        print("[INFO] Please run upload. There are no upload to be resume")
+        
+    
+    
+    
+
+###################
+# Delete the data #
+####################
+def delete(destination):
+    print("[INFO] Destination file is : ", destination)
+    
+    if destination:
+        print("[INFO] Get an existing or fresh token")
+        #Generate or get a token
+        init()
+            
+        #call the api to delete the data
+        #Get the presigned url to delete the data
+        print(gateway_url(destination))
+        response = gateway_request('DELETE', destination, allow_redirects=False)    
+        
+        location = response.headers['Location']
+        
+        #We have the 
+        if location:
+            #We delete the data using the location
+            print("[INFO] we are about to delete")
+            LISTINGS.invalidate(destination)
+            response = get_client().delete(location)
+            print(response)
+            delete_manifest(destination)
+        
+    else:
+        display_help()
+
+
+#################################################
+# Delete one data and its manifest, the token   #
+# is available. The response of the S3 is       #
+# returned                                      #
+#################################################
+def delete_object(key, manifest=True):
+    response = gateway_request('DELETE', key, allow_redirects=False)
+    response.raise_for_status()
+    location = response.headers.get('Location')
+    if not location:
+        raise IOError("No presigned url to delete "+ key)
+    response = get_client().delete(location)
+    response.raise_for_status()
+    if manifest and not key.endswith(MANIFEST_SUFFIX):
+        delete_manifest(key)
+    return response
+
+
+######################################################
+# Delete all the data of a folder or of a list of    #
+# keys, several at once, and print the failures      #
+######################################################
+def delete_many(prefix=None, keysFile=None, dryRun=False, workers=MAAP_S3_WORKERS, batch_size=DELETE_BATCH_SIZE):
+    print("[INFO] Get an existing or fresh token")
+    #Generate or get a token once for all the data
+    init()
+    if prefix:
+        print("[INFO] Delete all the data in : "+ prefix)
+        #The manifests are listed with their data
+        keys = (obj['key'] for obj in iter_objects(prefix, recursive=True, cache=False, manifests=True))
+    else:
+        print("[INFO] Delete the data listed in : "+ keysFile)
+        with open(keysFile) as f:
+            keys = [line.strip() for line in f if line.strip()]
+
+    deleted = 0
+    failed = {}
+    batch = []
+
+    def run(batch):
+        done = 0
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(delete_object, key, keysFile is not None): key for key in batch}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                    done += 1
+                except Exception as e:
+                    failed[futures[future]] = str(e)
+        return done
+
+    for key in keys:
+        if key.endswith('/'):
+            continue
+        if dryRun:
+            print("[INFO] Would delete "+ key)
+            deleted += 1
+            continue
+        batch.append(key)
+        if len(batch) == batch_size:
+            deleted += run(batch)
+            batch = []
+    if batch:
+        deleted += run(batch)
+
+    if prefix:
+        LISTINGS.invalidate(prefix)
+    for key in sorted(failed):
+        print("[ERROR] "+ key +" : "+ failed[key])
+    print("[INFO] "+ str(deleted) +(" to delete, " if dryRun else " deleted, ")+ str(len(failed)) +" failed")
+    return failed
+
+
+###################
+# download the data #
+####################
+def download(path, name):
+    print("[INFO] path file is : ", path)
+    
+    if path:
+        print("[INFO] Get an existing or fresh token")
+        #Generate or get a token
+        init()
+        download_path(path, name)
+        
+    else:
+        display_help()
+
+
+###########################################################
+# Download one data of the S3, the token is available     #
+###########################################################
+def download_path(path, name, journal=True):
+    #Get the presigned url to download the data
+    response = gateway_request('GET', path, allow_redirects=False)     
+    location = response.headers['Location']
+    
+    #We have the 
+    if location:
+        #We download the data using the location
+        print("[INFO] we are about to download the data")
+        download_file(location, name, path=path, journal=journal)
+        #response = requests.get(location)
+        #open(name, 'wb').write(response.content)
+        print("[INFO] Download finished")
+    return name
+
+
+
+##########################
+# download file using url #
+##########################       
+def download_file(url, name, segment_size=MAAP_S3_SEGMENT_SIZE, workers=MAAP_S3_WORKERS, path=None, journal=True):
+    #local_filename = url.split('/')[-1]
+    #Ask for the first byte to know the size and if the server accepts ranges
+    # NOTE the stream=True parameter below
+    with get_client().get(url, headers={'Range': 'bytes=0-0'}, stream=True) as r:
+        #An empty file has no byte to range over
+        if r.status_code != 416:
+            r.raise_for_status()
+        fileSize = content_range_size(r.status_code, r.headers)
+        eTag = r.headers.get('ETag')
+        #The segments follow the parts of the manifest so each one is checked on its own
+        manifest = fetch_manifest(path, eTag) if path else None
+        if manifest:
+            segment_size = manifest['partSize']
+        if fileSize is None:
+            #No range support, the server sends the whole file
+            r.raise_for_status()
+            print("[INFO] Range requests not supported, download in a single stream")
+            metrics = TransferMetrics('download', url.split('?')[0], name, int(r.headers.get('Content-Length', 0)))
+            checksum = StreamChecksum(segment_size)
+            try:
+                with open(name, 'wb') as f:
+                    for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        metrics.throttle.consume(len(chunk))
+                        f.write(chunk)
+                        checksum.update(chunk)
+                        metrics.add_bytes(len(chunk))
+                if manifest and checksum.parts() != manifest['parts']:
+                    raise IOError("Checksum mismatch for "+ name)
+            except Exception:
+                #The bandwidth of the transfer is given back to the others
+                metrics.close('failed')
+                raise
+            metrics.close()
+            return name
+
+    print("[INFO] Download "+ str(fileSize) +" bytes in segments of "+ str(segment_size) +" bytes with "+ str(workers) +" workers")
+    #Preallocate the file so each segment is written at its offset
+    with open(name, 'wb') as f:
+        f.truncate(fileSize)
+    #We save the downloaded segments so we can resume if download failed
+    downloadinfo = {
+        'path': path,
+        'name': name,
+        'fileSize': fileSize,
+        'eTag': eTag,
+        'segmentSize': segment_size,
+        'partMd5s': manifest['parts'] if manifest else None,
+        'completedSegments': []
+    }
+    download_missing(url, downloadinfo, workers, journal)
+    return name
+
+
+##################################################
+# Download the segments not yet in the journal,  #
+# then check the size of the file                #
+##################################################
+def download_missing(url, downloadinfo, workers=MAAP_S3_WORKERS, journal=True):
+    name = downloadinfo['name']
+    fileSize = downloadinfo['fileSize']
+    segment_size = downloadinfo['segmentSize']
+    completed = set(tuple(segment) for segment in downloadinfo['completedSegments'])
+    segments = [(start, min(start + segment_size, fileSize) - 1) for start in range(0, fileSize, segment_size)]
+    missing = [segment for segment in segments if segment not in completed]
+    print("[INFO] "+ str(len(missing)) +" of "+ str(len(segments)) +" segments to download")
+    lock = threading.Lock()
+
+    def save_segment(segment):
+        with lock:
+            downloadinfo['completedSegments'].append(segment)
+            if not journal:
+                return
+            #add the json in the file
+            with open(USER_LAST_DOWNLOAD_INFO_FILE_PATH, 'w') as outfile:
+                json.dump(downloadinfo, outfile)
+
+    #MD5 expected for each segment, from the manifest
+    checksums = None
+    if downloadinfo.get('partMd5s'):
+        checksums = dict(zip(range(0, fileSize, segment_size), downloadinfo['partMd5s']))
+
+    metrics = TransferMetrics('download', url.split('?')[0], name, fileSize)
+    metrics.add_bytes(sum(end - start + 1 for start, end in completed))
+    try:
+        download_segments(url, name, missing, workers, metrics, save_segment, checksums)
+    except Exception:
+        metrics.close('failed')
+        raise
+
+    if os.stat(name).st_size != fileSize:
+        metrics.close('failed')
+        raise IOError("Downloaded file "+ name +" does not have the expected size "+ str(fileSize))
+    metrics.close()
+    #delete the file of download info because download was success
+    if journal and os.path.isfile(USER_LAST_DOWNLOAD_INFO_FILE_PATH):
+        os.remove(USER_LAST_DOWNLOAD_INFO_FILE_PATH)
+
+
+###############################
+# Resume failed download      #
+###############################
+def resume_download():
+    print("[INFO] Resume the last download")
+
+    if os.path.isfile(USER_LAST_DOWNLOAD_INFO_FILE_PATH):
+        #Generate or get a token
+        init()
+        with open(USER_LAST_DOWNLOAD_INFO_FILE_PATH) as json_file:
+            downloadinfo = json.load(json_file)
+        path = downloadinfo['path']
+        name = downloadinfo['name']
+
+        #The presigned url of the first download may be expired, get a new one
+        response = gateway_request('GET', path, allow_redirects=False)
+        location = response.headers['Location']
+
+        with get_client().get(location, headers={'Range': 'bytes=0-0'}, stream=True) as r:
+            fileSize = content_range_size(r.status_code, r.headers)
+            eTag = r.headers.get('ETag')
+
+        #The data changed on the S3 or the partial file is gone, start again
+        if fileSize != downloadinfo['fileSize'] or eTag != downloadinfo['eTag'] or not os.path.isfile(name) or os.stat(name).st_size != fileSize:
+            print("[INFO] The data or the local file changed since the last download, download it again")
+            download_file(location, name, path=path)
+        else:
+            download_missing(location, downloadinfo)
+        print("[INFO] Download finished")
+
+    else:
+        print("[INFO] Please run download. There are no download to be resume")
+
+
+##################################################
+# Return the total size given in Content-Range, #
+# None when the server ignored the Range header #
+##################################################
+def content_range_size(status, headers):
+    contentRange = headers.get('Content-Range', '')
+    if status not in (206, 416) or '/' not in contentRange:
+        return None
+    total = contentRange.rsplit('/', 1)[1]
+    return int(total) if total.isdigit() else None
+
+
+#######################################################
+# Download byte ranges in parallel into an existing  #
+# file, each segment is written at its own offset    #
+#######################################################
+def download_segments(url, name, segments, workers=MAAP_S3_WORKERS, metrics=None, on_segment=None, checksums=None):
+
+    def fetch_segment(start, end):
+        written = 0
+        md5 = hashlib.md5()
+        try:
+            with TRANSFER_SLOTS:
+                with get_client().get(url, headers={'Range': 'bytes='+ str(start) +'-'+ str(end)}, stream=True) as r:
+                    r.raise_for_status()
+                    if r.status_code != 206:
+                        raise IOError("Range "+ str(start) +"-"+ str(end) +" not honoured by the server")
+                    with open(name, 'r+b') as f:
+                        f.seek(start)
+                        for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                            if metrics:
+                                metrics.throttle.consume(len(chunk))
+                            f.write(chunk)
+                            md5.update(chunk)
+                            written += len(chunk)
+                            if metrics:
+                                metrics.add_bytes(len(chunk))
+            if written != end - start + 1:
+                raise RetryableError("Segment "+ str(start) +"-"+ str(end) +" is incomplete")
+            if checksums and start in checksums and checksums[start] != md5.hexdigest():
+                raise RetryableError("Checksum mismatch for segment "+ str(start) +"-"+ str(end))
+        except Exception:
+            #The segment is written again from its start
+            if metrics:
+                metrics.add_bytes(-written)
+            raise
+        return written
+
+    def download_segment(number, segment):
+        start, end = segment
+        begin = time.time()
+        written = RETRIES.run(lambda: fetch_segment(start, end), "Segment "+ str(start) +"-"+ str(end), metrics)
+        if metrics:
+            metrics.part_done(number, written, time.time() - begin)
+        if on_segment:
+            on_segment(segment)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(download_segment, number, segment) for number, segment in enumerate(segments, 1)]
+        for future in as_completed(futures):
+            future.result()
+
+
+##################################################
+# Iterate over the objects of a S3 folder, page  #
+# by page. Each object is a dict with the key    #
+# and, when the gateway gives them, the size,    #
+# the ETag and the last modification date        #
+##################################################
+def iter_objects(path, recursive=False, page_size=MAAP_S3_LIST_PAGE_SIZE, cache=True, manifests=False):
+    cacheKey = path + ('|recursive' if recursive else '') + ('|manifests' if manifests else '')
+    if cache:
+        cached = LISTINGS.get(cacheKey)
+        if cached is not None:
+            for obj in cached:
+                yield obj
+            return
+
+    #The objects are only kept when the listing will be cached, otherwise they are streamed
+    keep = cache and LISTINGS.ttl > 0
+    objects = []
+    pending = [path]
+    seen = set()
+    while pending:
+        folder = pending.pop(0)
+        if folder in seen:
+            continue
+        seen.add(folder)
+        continuationToken = None
+        while True:
+            page, prefixes, continuationToken = list_page(folder, page_size, continuationToken)
+            for obj in page:
+                #Sub folders are listed in turn in recursive mode
+                if recursive and obj['key'].endswith('/'):
+                    pending.append(obj['key'])
+                    continue
+                #The checksum manifests are not data of the user
+                if obj['key'].endswith(MANIFEST_SUFFIX) and not manifests:
+                    continue
+                if keep:
+                    objects.append(obj)
+                yield obj
+            if recursive:
+                pending.extend(prefixes)
+            if not continuationToken:
+                break
+
+    #Only complete listings are cached
+    if keep:
+        LISTINGS.put(cacheKey, objects)
+
+
+###############################################
+# Return one page of a listing: the objects,  #
+# the sub folders and the token of the next   #
+# page, None on the last page                 #
+###############################################
+def list_page(path, page_size=MAAP_S3_LIST_PAGE_SIZE, continuationToken=None):
+    params = {'list': 'true', 'maxKeys': page_size}
+    if continuationToken:
+        params['continuationToken'] = continuationToken
+    response = gateway_request('GET', path, params=params, allow_redirects=False)
+    response.raise_for_status()
+    return parse_listing(response.text)
+
+
+def parse_listing(text):
+    try:
+        data = json.loads(text)
+    except ValueError:
+        #One key per line
+        return [{'key': line.strip()} for line in text.splitlines() if line.strip()], [], None
+    prefixes = []
+    continuationToken = None
+    if isinstance(data, dict):
+        prefixes = data.get('commonPrefixes', data.get('CommonPrefixes', []))
+        prefixes = [prefix if isinstance(prefix, str) else prefix.get('prefix', prefix.get('Prefix')) for prefix in prefixes]
+        if data.get('isTruncated', data.get('IsTruncated', True)):
+            continuationToken = data.get('nextContinuationToken', data.get('NextContinuationToken'))
+        data = data.get('contents', data.get('Contents', []))
+    objects = []
+    for item in data:
+        if isinstance(item, str):
+            objects.append({'key': item})
+        else:
+            objects.append({
+                'key': item.get('key', item.get('Key')),
+                'size': item.get('size', item.get('Size')),
+                'eTag': item.get('eTag', item.get('ETag')),
+                'lastModified': item.get('lastModified', item.get('LastModified'))
+            })
+    return objects, prefixes, continuationToken
+
+
+###############################################
+# Cache of the listings, kept in memory and   #
+# in a file so the next commands reuse it     #
+# until the time to live is over              #
+###############################################
+class ListingCache:
+    def __init__(self, ttl=MAAP_S3_LIST_CACHE_TTL):
+        self.ttl = ttl
+        self.listings = None
+        self.lock = threading.Lock()
+
+    def load(self):
+        if self.listings is None:
+            self.listings = {}
+            if os.path.isfile(LIST_CACHE_FILE_PATH):
+                with open(LIST_CACHE_FILE_PATH) as json_file:
+                    self.listings = json.load(json_file)
+
+    def save(self):
+        now = time.time()
+        self.listings = {key: value for key, value in self.listings.items() if now - value['time'] < self.ttl}
+        with open(LIST_CACHE_FILE_PATH, 'w') as outfile:
+            json.dump(self.listings, outfile)
+
+    def get(self, key):
+        if self.ttl <= 0:
+            return None
+        with self.lock:
+            self.load()
+            entry = self.listings.get(key)
+            if entry and time.time() - entry['time'] < self.ttl:
+                return entry['objects']
+            return None
+
+    def put(self, key, objects):
+        if self.ttl <= 0:
+            return
+        with self.lock:
+            self.load()
+            self.listings[key] = {'time': time.time(), 'objects': objects}
+            self.save()
+
+    #Forget the listings of the folders containing the given key
+    def invalidate(self, key):
+        if self.ttl <= 0:
+            return
+        with self.lock:
+            self.load()
+            stale = [cacheKey for cacheKey in self.listings if key.startswith(cacheKey.split('|')[0].rstrip('/'))]
+            for cacheKey in stale:
+                del self.listings[cacheKey]
+            if stale:
+                self.save()
+
+
+LISTINGS = ListingCache()
+
+
+################################################
+# Sync state, the size, mtime and ETag of the #
+# files transferred by upload-dir/download-dir #
+################################################
+def load_sync_state():
+    if os.path.isfile(SYNC_INFO_FILE_PATH):
+        with open(SYNC_INFO_FILE_PATH) as json_file:
+            return json.load(json_file)
+    return {'upload': {}, 'download': {}}
+
+
+def save_sync_state(state):
+    with open(SYNC_INFO_FILE_PATH, 'w') as outfile:
+        json.dump(state, outfile)
+
+
+######################################################
+# Run the transfers of a folder with bounded         #
+# concurrency and print a summary of the failures    #
+######################################################
+def run_transfers(transfers, workers=MAAP_S3_WORKERS):
+    done = 0
+    skipped = 0
+    failed = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(transfer): name for name, transfer in transfers}
+        for future in as_completed(futures):
+            try:
+                if future.result():
+                    done += 1
+                else:
+                    skipped += 1
+            except Exception as e:
+                print("[ERROR] "+ futures[future] +" : "+ str(e))
+                failed.append(futures[future])
+    print("[INFO] "+ str(done) +" transferred, "+ str(skipped) +" unchanged, "+ str(len(failed)) +" failed")
+    return failed
+
+
+####################################
+# Upload all the files of a folder #
+####################################
+def upload_dir(folder, destination, skip_unchanged=False):
+    print("[INFO] Source folder is : ", folder)
+    print("[INFO] Destination folder is : ", destination)
+    if not os.path.isdir(folder):
+        print("[ERROR] "+ folder +" is not a folder")
+        return [folder]
+    print("[INFO] Get an existing or fresh token")
+    #Generate or get a token once for all the files
+    init()
+    state = load_sync_state()
+    lock = threading.Lock()
+
+    def transfer(sourceFile, key):
+        stat = os.stat(sourceFile)
+        known = state['upload'].get(os.path.abspath(sourceFile))
+        if skip_unchanged and known and known['key'] == key and known['size'] == stat.st_size and known['mtime'] == stat.st_mtime:
+            return False
+        #Several files run at once, the resume file is kept for single uploads
+        upload_file(sourceFile, key, journal=False)
+        with lock:
+            state['upload'][os.path.abspath(sourceFile)] = {'key': key, 'size': stat.st_size, 'mtime': stat.st_mtime}
+            save_sync_state(state)
+        return True
+
+    transfers = [(sourceFile, lambda sourceFile=sourceFile, key=key: transfer(sourceFile, key))
+                 for sourceFile, key in folder_files(folder, destination)]
+    return run_transfers(transfers)
+
+
+###############################################
+# Files of a local folder and their key under #
+# the destination folder of the S3            #
+###############################################
+def folder_files(folder, destination):
+    files = []
+    for root, dirs, fileNames in os.walk(folder):
+        for fileName in sorted(fileNames):
+            sourceFile = os.path.join(root, fileName)
+            relative = os.path.relpath(sourceFile, folder).replace(os.sep, '/')
+            files.append((sourceFile, destination.rstrip('/') + '/' + relative))
+    return files
+
+
+#########################################
+# Download all the data of a S3 folder #
+#########################################
+def download_dir(path, folder, skip_unchanged=False):
+    print("[INFO] Source folder is : ", path)
+    print("[INFO] Destination folder is : ", folder)
+    print("[INFO] Get an existing or fresh token")
+    #Generate or get a token once for all the files
+    init()
+    state = load_sync_state()
+    lock = threading.Lock()
+
+    def transfer(obj, name):
+        known = state['download'].get(os.path.abspath(name))
+        if skip_unchanged and known and os.path.isfile(name):
+            stat = os.stat(name)
+            unchanged = known['size'] == stat.st_size and known['mtime'] == stat.st_mtime
+            if obj.get('eTag') and known.get('eTag'):
+                unchanged = unchanged and known['eTag'] == obj['eTag']
+            elif obj.get('size') is not None:
+                unchanged = unchanged and known['size'] == obj['size']
+            if unchanged:
+                return False
+        directory = os.path.dirname(name)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+        #Several files run at once, the resume file is kept for single downloads
+        download_path(obj['key'], name, journal=False)
+        stat = os.stat(name)
+        with lock:
+            state['download'][os.path.abspath(name)] = {'key': obj['key'], 'size': stat.st_size, 'mtime': stat.st_mtime, 'eTag': obj.get('eTag')}
+            save_sync_state(state)
+        return True
+
+    transfers = [(obj['key'], lambda obj=obj, name=name: transfer(obj, name))
+                 for obj, name in folder_objects(path, folder)]
+    return run_transfers(transfers)
+
+
+###################################################
+# Data of a S3 folder and their local file in the #
+# destination folder                              #
+###################################################
+def folder_objects(path, folder):
+    prefix = path.rstrip('/') + '/'
+    objects = []
+    for obj in iter_objects(path, recursive=True, cache=False):
+        key = obj['key']
+        relative = key[len(prefix):] if key.startswith(prefix) else key.split('/')[-1]
+        if not relative or relative.endswith('/'):
+            continue
+        objects.append((obj, os.path.join(folder, *relative.split('/'))))
+    return objects
+
+
+##########################
+# list data in s3 folder #
+##########################
+def list(path, recursive=False, jsonLines=False):
+    print("[INFO]: Start finding data in path : "+path)
+    
+    if path:
+        print("[INFO] Get an existing or fresh token")
+        #Generate or get a token
+        init()
+            
+        #call the api to list the data, the objects are printed page by page
+        print("[INFO] Result list:")  
+        found = 0
+        for obj in iter_objects(path, recursive):
+            found += 1
+            if jsonLines:
+                print(json.dumps(obj))
+            else:
+                print(obj['key'] + ''.join('  ' + str(obj[field]) for field in ('size', 'lastModified') if obj.get(field) is not None))
+        if not found:
+            print("[INFO] No data found")
+    else:
+        display_help()
+
+###############################################
+# aiohttp is only needed by the asyncio       #
+# backend, it is imported when first used     #
+###############################################
+def import_aiohttp():
+    try:
+        import aiohttp
+    except ImportError:
+        raise MaapS3Error("The asyncio backend needs aiohttp, install it with: pip install aiohttp")
+    return aiohttp
+
+
+####################################################
+# Bytes of the files held in memory by the asyncio #
+# backend, a read waits until enough is released   #
+####################################################
+class MemoryBudget:
+    def __init__(self, nbBytes):
+        self.total = nbBytes
+        self.available = nbBytes
+        self.condition = asyncio.Condition()
+
+    async def acquire(self, nbBytes):
+        #A block bigger than the budget would wait forever, it waits for the whole budget
+        nbBytes = min(nbBytes, self.total)
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.available >= nbBytes)
+            self.available -= nbBytes
+        return nbBytes
+
+    async def release(self, nbBytes):
+        async with self.condition:
+            self.available += nbBytes
+            self.condition.notify_all()
+
+
+def preallocate(name, fileSize):
+    with open(name, 'wb') as f:
+        f.truncate(fileSize)
+
+
+def write_chunk(f, chunk, md5):
+    f.write(chunk)
+    md5.update(chunk)
+
+
+#######################################################
+# Transfers run on an event loop: hundreds of requests #
+# share one aiohttp session, the files are read and   #
+# written by a few threads and the parts waiting to   #
+# be sent are bounded by the memory budget. Only the  #
+# token and the presigned urls of the parts use the   #
+# sync client                                         #
+#######################################################
+class AsyncTransfer:
+    def __init__(self, requests=MAAP_S3_ASYNC_REQUESTS, readers=MAAP_S3_ASYNC_READERS, memory_budget=MAAP_S3_MEMORY_BUDGET, files=MAAP_S3_ASYNC_FILES):
+        self.aiohttp = import_aiohttp()
+        self.requests = requests
+        self.nbFiles = files
+        self.memory_budget = memory_budget
+        self.executor = ThreadPoolExecutor(max_workers=readers)
+        #Errors of aiohttp retried like the connection errors of requests
+        self.transient = (self.aiohttp.ClientError, asyncio.TimeoutError)
+
+    async def __aenter__(self):
+        #Created here so they belong to the running loop
+        self.session = self.aiohttp.ClientSession(connector=self.aiohttp.TCPConnector(limit=self.requests))
+        self.slots = asyncio.Semaphore(self.requests)
+        self.files = asyncio.Semaphore(self.nbFiles)
+        self.memory = MemoryBudget(self.memory_budget)
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.session.close()
+        self.executor.shutdown(wait=False)
+
+    #Run a blocking function on the threads of the transfer
+    async def blocking(self, function, *args):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.executor, lambda: function(*args))
+
+    #Run the coroutines together, the first error cancels the others
+    async def run_all(self, coroutines):
+        tasks = [asyncio.ensure_future(coroutine) for coroutine in coroutines]
+        try:
+            return await asyncio.gather(*tasks)
+        except Exception:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+    #Run one transfer per (source, destination), a few files at once, and print
+    #the failures like the folder commands
+    async def run_many(self, transfer, pairs):
+        async def run(source, destination):
+            try:
+                async with self.files:
+                    await transfer(source, destination)
+                return None
+            except Exception as e:
+                print("[ERROR] "+ str(source) +" : "+ str(e))
+                return source
+        failed = [source for source in await asyncio.gather(*[run(source, destination) for source, destination in pairs]) if source]
+        print("[INFO] "+ str(len(pairs) - len(failed)) +" transferred, "+ str(len(failed)) +" failed")
+        return failed
+
+    async def upload(self, source, destination):
+        if os.path.isdir(source):
+            pairs = await self.blocking(folder_files, source, destination)
+            #Several files run at once, the resume file is kept for single uploads
+            raise_failures(await self.run_many(lambda sourceFile, key: self.upload_file(sourceFile, key, journal=False), pairs), source)
+            return destination
+        return await self.upload_file(source, destination)
+
+    async def download(self, path, name):
+        if path.endswith('/'):
+            pairs = [(obj['key'], fileName) for obj, fileName in await self.blocking(folder_objects, path, name)]
+            raise_failures(await self.run_many(self.download_path, pairs), path)
+            return name
+        return await self.download_path(path, name)
+
+    #Call the gateway on the loop, a rejected token is generated again once.
+    #Return the status, the headers and the body
+    async def gateway(self, method, path, **kwargs):
+        token = await self.blocking(TOKENS.get)
+        for attempt in range(2):
+            async with self.slots:
+                async with self.session.request(method, gateway_url(path), headers={'Authorization': 'Bearer '+ token}, allow_redirects=False, **kwargs) as response:
+                    body = await response.read()
+            if response.status != 401 or attempt:
+                return response.status, response.headers, body
+            token = await self.blocking(TOKENS.refresh, token)
+
+    #Presigned url given by the gateway for a data
+    async def location(self, method, path):
+        status, headers, body = await self.gateway(method, path)
+        location = headers.get('Location')
+        if not location:
+            raise IOError("No presigned url for "+ path +", status "+ str(status))
+        return location
+
+    async def upload_manifest(self, destination, manifest):
+        if not MAAP_S3_MANIFEST:
+            return
+        status, headers, body = await self.gateway('PUT', destination + MANIFEST_SUFFIX)
+        if headers.get('Location'):
+            async with self.slots:
+                async with self.session.put(headers['Location'], data=json.dumps(manifest).encode()) as response:
+                    await response.read()
+                    status = response.status
+        if status >= 300:
+            print("[ERROR] The checksum manifest of "+ destination +" could not be saved")
+
+    async def fetch_manifest(self, path, eTag):
+        if not has_manifest(eTag):
+            return None
+        status, headers, body = await self.gateway('GET', path + MANIFEST_SUFFIX)
+        if not headers.get('Location'):
+            return None
+        async with self.slots:
+            async with self.session.get(headers['Location']) as response:
+                body = await response.read()
+                if response.status >= 300:
+                    return None
+        try:
+            manifest = json.loads(body.decode())
+        except ValueError:
+            return None
+        if not eTag or manifest.get('eTag') != eTag.strip('"'):
+            print("[INFO] The checksum manifest does not match the data, it will not be verified")
+            return None
+        return manifest
+
+    #Send data to a presigned url and return the headers of the answer
+    async def put(self, url, data, headers, throttle, what):
+        await asyncio.sleep(throttle.reserve(len(data)))
+        async with self.slots:
+            async with self.session.put(url, data=data, headers=headers) as response:
+                await response.read()
+        if response.status >= 300:
+            raise StatusError(response.status, what)
+        return response.headers
+
+    async def upload_file(self, sourceFile, destination, journal=True):
+        LISTINGS.invalidate(destination)
+        fileSize = os.stat(sourceFile).st_size
+        if fileSize > MAAP_S3_MULTIPART_THRESHOLD:
+            return await self.upload_multipart(sourceFile, destination, journal)
+
+        location = await self.location('PUT', destination)
+        metrics = TransferMetrics('upload', sourceFile, destination, fileSize)
+        reserved = 0
+        source = None
+        try:
+            reserved = await self.memory.acquire(fileSize)
+            #An empty file can not be mapped
+            source = await self.blocking(map_file, sourceFile) if fileSize else None
+            data = memoryview(source) if source else b''
+            checksum = StreamChecksum(MAAP_S3_SEGMENT_SIZE)
+            await self.blocking(checksum.update, data)
+            md5 = checksum.md5.hexdigest()
+            start = time.time()
+
+            async def send():
+                headers = await self.put(location, data, md5_headers(location, checksum.md5.digest()), metrics.throttle, sourceFile)
+                check_etag(headers.get('ETag', ''), md5, sourceFile)
+
+            await RETRIES.run_async(send, sourceFile, metrics, transient=self.transient)
+        except Exception:
+            metrics.close('failed')
+            raise
+        finally:
+            data = None
+            if source:
+                close_map(source)
+            await self.memory.release(reserved)
+        metrics.part_done(1, fileSize, time.time() - start)
+        metrics.add_bytes(fileSize)
+        metrics.close()
+        return destination
+
+    async def upload_multipart(self, sourceFile, destination, journal=True):
+        fileStat = os.stat(sourceFile)
+        fileSize = fileStat.st_size
+        #As many parts in memory as requests in flight, within the memory budget
+        max_size, nbParts = plan_parts(fileSize, workers=self.requests)
+        print("[INFO] We will have "+ str(nbParts)+" parts of "+ str(max_size) +" bytes uploaded by "+ str(self.requests) +" requests in flight")
+        status, headers, body = await self.gateway('GET', 'generateUploadId', params={'bucketName': 'bmap-catalogue-data', 'objectKey': destination})
+        if status >= 300:
+            raise IOError("No upload id for "+ destination +", status "+ str(status))
+        uploadId = body.decode()
+        presignedUrls = PresignedUrlProvider(destination, uploadId, nbParts)
+        source = await self.blocking(map_file, sourceFile)
+        metrics = TransferMetrics('upload_multipart', sourceFile, destination, fileSize)
+        parts = {}
+        partMd5s = {}
+
+        async def upload_part(partNumber):
+            offset = (partNumber-1) * max_size
+            size = min(max_size, fileSize - offset)
+            #The memory budget bounds the mapped pages being sent
+            reserved = await self.memory.acquire(size)
+            data = memoryview(source)[offset:offset + size]
+            try:
+                digest = (await self.blocking(hashlib.md5, data)).digest()
+                md5 = binascii.hexlify(digest).decode()
+                what = "Part "+ str(partNumber)
+
+                async def send():
+                    try:
+                        presignedUrl = await self.blocking(presignedUrls.get, partNumber)
+                        responseHeaders = await self.put(presignedUrl, data, md5_headers(presignedUrl, digest), metrics.throttle, what)
+                    except StatusError as e:
+                        if e.status == 403:
+                            #The url expired before its part was sent, the next attempt gets a new one
+                            presignedUrls.expire(partNumber)
+                        raise
+                    check_etag(responseHeaders['ETag'], md5, what)
+                    return responseHeaders['ETag']
+
+                start = time.time()
+                etag = await RETRIES.run_async(send, what, metrics, statuses=(403,), transient=self.transient)
+            finally:
+                data = None
+                release_pages(source, offset, size)
+                await self.memory.release(reserved)
+            metrics.part_done(partNumber, size, time.time() - start)
+            metrics.add_bytes(size)
+            parts[partNumber] = etag
+            partMd5s[partNumber] = md5
+            #The parts sent are saved so the sync resume command can finish the upload
+            if journal:
+                await self.blocking(save_upload_journal, uploadId, dict(parts), sourceFile, destination, max_size, fileSize, dict(partMd5s), fileStat.st_mtime)
+
+        try:
+            try:
+                await self.run_all(upload_part(partNumber) for partNumber in range(1, nbParts+1))
+            finally:
+                close_map(source)
+
+            params = {'bucketName': 'bmap-catalogue-data', 'objectKey': destination, 'nbParts': str(nbParts), 'uploadId': uploadId}
+            status, headers, body = await self.gateway('GET', 'completeMultiPartUploadRequest', data=str(ordered_parts(parts)), params=params)
+            if status >= 300:
+                raise IOError("Multipart upload of "+ sourceFile +" not completed, status "+ str(status))
+        except Exception:
+            metrics.close('failed')
+            raise
+        metrics.close()
+        await self.upload_manifest(destination, make_manifest(fileSize, max_size, [partMd5s[partNumber] for partNumber in sorted(partMd5s)]))
+        if journal and os.path.isfile(USER_LAST_UPLOAD_INFO_FILE_PATH):
+            os.remove(USER_LAST_UPLOAD_INFO_FILE_PATH)
+        return destination
+
+    async def download_path(self, path, name):
+        location = await self.location('GET', path)
+        directory = os.path.dirname(name)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+
+        #Ask for the first byte to know the size and if the server accepts ranges. The slot is
+        #given back before the manifest is fetched, the gateway call takes one too
+        async with self.slots:
+            async with self.session.get(location, headers={'Range': 'bytes=0-0'}) as r:
+                if r.status >= 300 and r.status != 416:
+                    raise IOError("Download of "+ path +" failed with status "+ str(r.status))
+                fileSize = content_range_size(r.status, r.headers)
+                eTag = r.headers.get('ETag')
+        manifest = await self.fetch_manifest(path, eTag)
+        segment_size = manifest['partSize'] if manifest else MAAP_S3_SEGMENT_SIZE
+        if fileSize is None:
+            #No range support, the server sends the whole file
+            async with self.slots:
+                async with self.session.get(location) as r:
+                    if r.status >= 300:
+                        raise IOError("Download of "+ path +" failed with status "+ str(r.status))
+                    metrics = TransferMetrics('download', location.split('?')[0], name, int(r.headers.get('Content-Length', 0)))
+                    checksum = StreamChecksum(segment_size)
+                    try:
+                        f = await self.blocking(open, name, 'wb')
+                        try:
+                            async for chunk in r.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                                await asyncio.sleep(metrics.throttle.reserve(len(chunk)))
+                                await self.blocking(write_chunk, f, chunk, checksum)
+                                metrics.add_bytes(len(chunk))
+                        finally:
+                            await self.blocking(f.close)
+                        if manifest and checksum.parts() != manifest['parts']:
+                            raise IOError("Checksum mismatch for "+ name)
+                    except Exception:
+                        #The bandwidth of the transfer is given back to the others
+                        metrics.close('failed')
+                        raise
+                    metrics.close()
+                    return name
+
+        await self.blocking(preallocate, name, fileSize)
+        segments = [(start, min(start + segment_size, fileSize) - 1) for start in range(0, fileSize, segment_size)]
+        checksums = dict(zip(range(0, fileSize, segment_size), manifest['parts'])) if manifest else {}
+        metrics = TransferMetrics('download', location.split('?')[0], name, fileSize)
+
+        async def fetch_segment(start, end):
+            what = "Segment "+ str(start) +"-"+ str(end)
+            md5 = hashlib.md5()
+            written = 0
+            f = await self.blocking(open, name, 'r+b')
+            try:
+                await self.blocking(f.seek, start)
+                async with self.slots:
+                    async with self.session.get(location, headers={'Range': 'bytes='+ str(start) +'-'+ str(end)}) as r:
+                        if r.status >= 300:
+                            raise StatusError(r.status, what)
+                        if r.status != 206:
+                            raise IOError("Range "+ str(start) +"-"+ str(end) +" not honoured by the server")
+                        async for chunk in r.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                            await asyncio.sleep(metrics.throttle.reserve(len(chunk)))
+                            await self.blocking(write_chunk, f, chunk, md5)
+                            written += len(chunk)
+                            metrics.add_bytes(len(chunk))
+                if written != end - start + 1:
+                    raise RetryableError(what +" is incomplete")
+                if start in checksums and checksums[start] != md5.hexdigest():
+                    raise RetryableError("Checksum mismatch for "+ what)
+            except Exception:
+                #The segment is written again from its start
+                metrics.add_bytes(-written)
+                raise
+            finally:
+                await self.blocking(f.close)
+            return written
+
+        async def download_segment(number, segment):
+            start, end = segment
+            begin = time.time()
+            written = await RETRIES.run_async(lambda: fetch_segment(start, end), "Segment "+ str(start) +"-"+ str(end), metrics, transient=self.transient)
+            metrics.part_done(number, written, time.time() - begin)
+
+        try:
+            await self.run_all(download_segment(number, segment) for number, segment in enumerate(segments, 1))
+        except Exception:
+            metrics.close('failed')
+            raise
+        metrics.close()
+        return name
+
+
+#Raise the failures of a folder transfer, the Client returns the same result on both backends
+def raise_failures(failed, source):
+    if failed:
+        raise MaapS3Error(str(len(failed)) +" files of "+ source +" not transferred")
+
+
+#######################################################
+# Client kept by a notebook for many operations: the #
+# token, the connections and the listing cache are   #
+# reused from one call to the next. They belong to   #
+# the process, the Clients of a process share them:  #
+# one account, and the bandwidth limits given last   #
+#######################################################
+class Client:
+    def __init__(self, email=None, password=None, bandwidth=None, transferBandwidth=None, backend=MAAP_S3_BACKEND):
+        global open_clients
+        if backend not in ('thread', 'asyncio'):
+            raise MaapS3Error("Unknown backend "+ str(backend) +", use thread or asyncio")
+        if backend == 'asyncio':
+            import_aiohttp()
+        self.backend = backend
+        #Without credentials the user info file is used, as by the command line
+        if email and password:
+            with TOKENS.lock:
+                if TOKENS.email and (TOKENS.email != email or TOKENS.password != password):
+                    raise MaapS3Error("This process already uses the account "+ TOKENS.email +", a Client can not use other credentials")
+                if not TOKENS.email:
+                    TOKENS.set(email, password, None, 0)
+        if bandwidth is not None or transferBandwidth is not None:
+            BANDWIDTH.configure(rate=None if bandwidth is None else parse_rate(bandwidth),
+                                transfer_rate=None if transferBandwidth is None else parse_rate(transferBandwidth))
+        #Runs the blocking operations of the async variants
+        self.executor = ThreadPoolExecutor(max_workers=MAAP_S3_WORKERS)
+        self.closed = False
+        with client_lock:
+            open_clients += 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        global client, open_clients
+        if self.closed:
+            return
+        self.closed = True
+        self.executor.shutdown(wait=True)
+        #The last Client closes the connections, the next request opens new ones
+        with client_lock:
+            open_clients -= 1
+            if open_clients == 0 and client is not None:
+                client.close()
+                client = None
+
+    #Upload a file, or all the files of a folder
+    def upload(self, source, destination):
+        if self.backend == 'asyncio':
+            return self.run_sync(self.upload_async(source, destination))
+        TOKENS.get()
+        if os.path.isdir(source):
+            raise_failures(upload_dir(source, destination), source)
+        else:
+            upload_file(source, destination)
+        return destination
+
+    #Download a data, or all the data of a folder when the path ends with /
+    def download(self, path, name):
+        if self.backend == 'asyncio':
+            return self.run_sync(self.download_async(path, name))
+        TOKENS.get()
+        if path.endswith('/'):
+            raise_failures(download_dir(path, name), path)
+            return name
+        return download_path(path, name)
+
+    #Objects of a folder, as returned by the listing
+    def list(self, path, recursive=False):
+        TOKENS.get()
+        return [obj for obj in iter_objects(path, recursive)]
+
+    #Delete a data, or all the data of a folder in recursive mode
+    def delete(self, path, recursive=False):
+        TOKENS.get()
+        if recursive:
+            failed = delete_many(prefix=path)
+            if failed:
+                raise MaapS3Error(str(len(failed)) +" data of "+ path +" not deleted")
+        else:
+            delete_object(path)
+            LISTINGS.invalidate(path)
+
+    async def run_async(self, function, *args):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.executor, lambda: function(*args))
+
+    #Run a coroutine to the end from sync code, on its own loop since
+    #the caller may already be in one (a notebook). The loop has its own thread,
+    #the executor stays free for the blocking calls of the coroutine
+    def run_sync(self, coroutine):
+        with ThreadPoolExecutor(max_workers=1) as loop:
+            return loop.submit(asyncio.run, coroutine).result()
+
+    #With the asyncio backend the transfers run on the loop of the caller
+    async def upload_async(self, source, destination):
+        if self.backend == 'asyncio':
+            await self.run_async(TOKENS.get)
+            async with AsyncTransfer() as transfer:
+                return await transfer.upload(source, destination)
+        return await self.run_async(self.upload, source, destination)
+
+    async def download_async(self, path, name):
+        if self.backend == 'asyncio':
+            await self.run_async(TOKENS.get)
+            async with AsyncTransfer() as transfer:
+                return await transfer.download(path, name)
+        return await self.run_async(self.download, path, name)
+
+    async def list_async(self, path, recursive=False):
+        return await self.run_async(self.list, path, recursive)
+
+    async def delete_async(self, path, recursive=False):
+        return await self.run_async(self.delete, path, recursive)
+
+
+###########################################
+# Command line, maap-s3.py calls it with  #
+# its arguments and exits with the result #
+###########################################
+def main(argv=None):
+    global MAAP_S3_PRIORITY
+    argv = sys.argv[1:] if argv is None else argv
+    try:
+        # Bandwidth options come before the command, the arguments of the command are left as they are
+        opts, argv = getopt.getopt(argv, 'h', ['help', 'limit-rate=', 'transfer-limit-rate=', 'priority='])
+        for opt, value in opts:
+            if opt in ('-h', '--help'):
+                display_help()
+                return 0
+            elif opt == '--limit-rate':
+                BANDWIDTH.configure(rate=parse_rate(value))
+            elif opt == '--transfer-limit-rate':
+                BANDWIDTH.configure(transfer_rate=parse_rate(value))
+            elif opt == '--priority':
+                MAAP_S3_PRIORITY = int(value)
+    except getopt.GetoptError:
+        # Print the error message if the wrong option is provided
+        print('The wrong option is provided. Please run -h')
+        return 2
+
+    try:
+        return run_command(argv)
+    except MaapS3Error as e:
+        print("[ERROR] "+ str(e))
+        return 2
+
+
+def run_command(argv):
+    if len(argv) == 0:
+        return display_help()
+    if argv[0] == 'resume':
+        resume()
+    elif argv[0] == 'resume-download':
+        resume_download()
+    elif argv[0] == 'refresh':
+        refresh()
+    elif argv[0] == 'upload':
+        # Upload a data
+        if len(argv) != 3:
+            return display_help()
+        upload(argv[1], argv[2])
+    elif argv[0] == 'delete':
+        # Delete a data, or all the data of a folder or of a file
+        dryRun = '--dry-run' in argv
+        options = [arg for arg in argv[1:] if arg != '--dry-run']
+        if len(options) == 2 and options[0] == '--prefix':
+            return 1 if delete_many(prefix=options[1], dryRun=dryRun) else 0
+        elif len(options) == 2 and options[0] == '--from-file':
+            return 1 if delete_many(keysFile=options[1], dryRun=dryRun) else 0
+        elif len(options) == 1 and not dryRun:
+            delete(options[0])
+        else:
+            return display_help()
+    elif argv[0] == 'token':
+        # Print a token
+        if len(argv) != 3:
+            return display_help()
+        get_token(argv[1], argv[2])
+    elif argv[0] == 'login':
+        # Generate and save a token
+        if len(argv) != 3:
+            return display_help()
+        login(argv[1], argv[2])
+    elif argv[0] in ('upload-dir', 'download-dir', 'sync'):
+        # Transfer a folder, the exit code tells if some files failed
+        if len(argv) != 3:
+            return display_help()
+        if argv[0] == 'upload-dir':
+            failed = upload_dir(argv[1], argv[2])
+        elif argv[0] == 'download-dir':
+            failed = download_dir(argv[1], argv[2])
+        elif os.path.isdir(argv[1]):
+            failed = upload_dir(argv[1], argv[2], skip_unchanged=True)
+        else:
+            failed = download_dir(argv[1], argv[2], skip_unchanged=True)
+        return 1 if failed else 0
+    elif argv[0] == 'download':
+        # Download a data
+        if len(argv) != 3:
+            return display_help()
+        download(argv[1], argv[2])
+    elif argv[0] == 'help':
+        display_help()
+    elif argv[0] == 'list':
+        # list a folder
+        options = argv[2:]
+        if len(argv) < 2 or [option for option in options if option not in ('--recursive', '--json')]:
+            return display_help()
+        list(argv[1], '--recursive' in options, '--json' in options)
+    else:
+        return display_help()
+    return 0
@@ -0,0 +1,127 @@
+#Benchmarks of maap_s3 against the local stand-in of the gateway and of the S3 (see conftest.py),
+#the tests run them on small sizes. From the image folder:
+#   python tests/benchmark_maap_s3.py [upload] [download] [handshakes] [--size MIB] [--latency SECONDS] [--rate MIB]
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from conftest import StandIn, maap_s3
+
+MIB = 1024 * 1024
+
+
+#maap_s3 talking to the stand-in with its files in folder, as the s3 fixture does
+def configure(s3, standin, folder):
+    s3.gateway_url = lambda path: standin.base + '/s3/' + path
+    for name in ('USER_INFO_FILE_PATH', 'USER_LAST_UPLOAD_INFO_FILE_PATH', 'USER_LAST_DOWNLOAD_INFO_FILE_PATH',
+                 'SYNC_INFO_FILE_PATH', 'LIST_CACHE_FILE_PATH'):
+        setattr(s3, name, os.path.join(folder, name.lower() + '.json'))
+    s3.TRANSFER_LOG_FILE_PATH = ''
+    s3.TOKENS.set('user@esa.int', 'password', 'token', 4102444800)
+    s3.S3_MIN_PART_SIZE = MIB
+    s3.MAAP_S3_MULTIPART_THRESHOLD = 2 * MIB
+    return s3
+
+
+def source_file(folder, size):
+    sourceFile = os.path.join(folder, 'data.bin')
+    with open(sourceFile, 'wb') as f:
+        f.write(os.urandom(size))
+    return sourceFile
+
+
+#Upload throughput in MiB/s of a multipart upload for each number of workers,
+#one worker sends the parts one after another as before the worker pool
+def upload_throughput(s3, standin, folder, size=32 * MIB, workers=(1, 4, 8)):
+    sourceFile = source_file(folder, size)
+    rates = {}
+    for count in workers:
+        start = time.time()
+        s3.upload_multipart(sourceFile, 'bench/data.bin', workers=count, journal=False)
+        rates[count] = size / MIB / (time.time() - start)
+    return rates
+
+
+#Download throughput in MiB/s for each number of workers fetching segments of 1 MiB,
+#and of a single stream when the server ignores the ranges
+def download_throughput(s3, standin, folder, size=32 * MIB, workers=(1, 4, 8)):
+    standin.objects['bench/data.bin'] = os.urandom(size)
+    url = standin.base + '/obj/bench/data.bin'
+    name = os.path.join(folder, 'download.bin')
+    rates = {}
+    for count in workers:
+        start = time.time()
+        s3.download_file(url, name, segment_size=MIB, workers=count, journal=False)
+        rates[count] = size / MIB / (time.time() - start)
+    standin.ranges = False
+    start = time.time()
+    s3.download_file(url, name, journal=False)
+    rates['single stream'] = size / MIB / (time.time() - start)
+    standin.ranges = True
+    return rates
+
+
+#Connections opened and requests sent by an upload then a download, for each number of
+#workers, with a new pool for each count. Without the pool each request was a handshake
+def handshakes(s3, standin, folder, size=32 * MIB, workers=(1, 4, 8)):
+    sourceFile = source_file(folder, size)
+    counts = {}
+    for count in workers:
+        if s3.client is not None:
+            s3.client.close()
+        s3.client = None
+        connections, requests = standin.connections, standin.requests
+        s3.upload_multipart(sourceFile, 'bench/data.bin', workers=count, journal=False)
+        s3.download_file(standin.base + '/obj/bench/data.bin', os.path.join(folder, 'download.bin'),
+                         segment_size=MIB, workers=count, journal=False)
+        counts[count] = (standin.connections - connections, standin.requests - requests)
+    return counts
+
+
+#The progress printed by maap_s3 is left out of the results
+def quiet():
+    return contextlib.redirect_stdout(io.StringIO())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='maap_s3 benchmarks against a local stand-in')
+    parser.add_argument('benchmarks', nargs='*', default=['upload', 'download', 'handshakes'])
+    parser.add_argument('--size', type=int, default=64, help='MiB transferred')
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds of each part or segment request')
+    parser.add_argument('--rate', type=float, default=20, help='MiB/s of each download connection, 0 is unlimited')
+    args = parser.parse_args(argv)
+    standin = StandIn()
+    standin.latency = args.latency
+    standin.rate = args.rate * MIB
+    try:
+        with tempfile.TemporaryDirectory() as folder:
+            s3 = configure(maap_s3, standin, folder)
+            if 'upload' in args.benchmarks:
+                print('upload of %d MiB, parts of 1 MiB, %.3f s per part' % (args.size, args.latency))
+                with quiet():
+                    rates = upload_throughput(s3, standin, folder, args.size * MIB)
+                for count, rate in rates.items():
+                    print('  %2d workers  %8.1f MiB/s' % (count, rate))
+            if 'download' in args.benchmarks:
+                print('download of %d MiB, segments of 1 MiB, %.3f s per segment, %g MiB/s per connection' % (args.size, args.latency, args.rate))
+                with quiet():
+                    rates = download_throughput(s3, standin, folder, args.size * MIB)
+                for count, rate in rates.items():
+                    print('  %-13s %8.1f MiB/s' % (count if isinstance(count, str) else '%d workers' % count, rate))
+            if 'handshakes' in args.benchmarks:
+                print('upload then download of %d MiB in parts and segments of 1 MiB' % args.size)
+                with quiet():
+                    counts = handshakes(s3, standin, folder, args.size * MIB)
+                for count, (connections, requests) in counts.items():
+                    print('  %2d workers  %4d connections for %4d requests' % (count, connections, requests))
+    finally:
+        standin.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,246 @@
+import base64
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import maap_s3
+
+
+#####################################################
+# Local stand-in of the gateway and of the S3: the  #
+# gateway redirects to the data, the multipart api  #
+# gives presigned urls of parts kept in memory      #
+#####################################################
+class StandIn:
+    def __init__(self):
+        self.objects = {}
+        #ETags of the multipart uploads, MD5 of the part MD5s and number of parts
+        self.etags = {}
+        #MD5 of the data of each key, computed once and not for each range
+        self.md5s = {}
+        self.parts = {}
+        #Part numbers answered with a 503 once, keys whose upload is refused
+        #and status of the completion request (None closes the connection)
+        self.fail_parts = set()
+        self.fail_keys = set()
+        self.complete_status = 200
+        #Signature of the part urls (v4 or v2), and ETags unrelated to the data like with KMS
+        self.signature = 'v4'
+        self.kms = False
+        #Set to False to ignore the Range header like a server without range support
+        self.ranges = True
+        #Start offsets of the ranges answered with a 503, as many times as their count,
+        #and the Range header of every data GET
+        self.fail_ranges = {}
+        self.gets = []
+        #Seconds taken by each part PUT and data GET, like the round trip of a distant S3,
+        #and bytes per second of each response (0 is unlimited) like a single TCP stream
+        self.latency = 0
+        self.rate = 0
+        self.part_puts = 0
+        #Connections accepted (TCP handshakes) and requests answered
+        self.connections = 0
+        self.requests = 0
+        self.url_requests = []
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self.handler())
+        self.base = 'http://127.0.0.1:%d' % self.server.server_port
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def object_etag(self, key, data):
+        if key in self.etags:
+            return self.etags[key]
+        with self.lock:
+            cached = self.md5s.get(key)
+            if cached is None or cached[0] is not data:
+                cached = self.md5s[key] = (data, hashlib.md5(data).hexdigest())
+        return cached[1]
+
+    def etag(self, data):
+        if self.kms:
+            return '"%s"' % os.urandom(16).hex()
+        return '"%s"' % hashlib.md5(data).hexdigest()
+
+    def handler(self):
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def setup(self):
+                with standin.lock:
+                    standin.connections += 1
+                BaseHTTPRequestHandler.setup(self)
+
+            def body(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                return self.rfile.read(length) if length else b''
+
+            def send(self, status, data=b'', headers=None):
+                with standin.lock:
+                    standin.requests += 1
+                self.send_response(status)
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                if self.command == 'HEAD':
+                    return
+                step = 64 * 1024 if standin.rate else len(data) or 1
+                for offset in range(0, len(data), step):
+                    self.wfile.write(data[offset:offset + step])
+                    if standin.rate:
+                        time.sleep(step / standin.rate)
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = {key: value[0] for key, value in parse_qs(url.query).items()}
+                self.body()
+                if url.path == '/s3/generateUploadId':
+                    with standin.lock:
+                        uploadId = 'upload-%d' % (len(standin.parts) + 1)
+                        standin.parts[uploadId] = {}
+                    return self.send(200, uploadId.encode())
+                if url.path == '/s3/generateListPresignedUrls':
+                    nbParts = int(query['nbParts'])
+                    standin.url_requests.append(nbParts)
+                    if standin.signature == 'v2':
+                        signature = 'AWSAccessKeyId=key&Expires=4102444800&Signature=signature'
+                    else:
+                        signature = 'X-Amz-Date=20990101T000000Z&X-Amz-Expires=3600&X-Amz-Signature=signature'
+                    urls = [standin.base + '/part/%s/%d?%s' % (query['uploadId'], number, signature)
+                            for number in range(1, nbParts + 1)]
+                    return self.send(200, json.dumps(urls).encode())
+                if url.path == '/s3/completeMultiPartUploadRequest':
+                    if standin.complete_status is None:
+                        self.close_connection = True
+                        return
+                    if standin.complete_status != 200:
+                        return self.send(standin.complete_status)
+                    with standin.lock:
+                        parts = standin.parts.get(query['uploadId'], {})
+                        standin.objects[query['objectKey']] = b''.join(parts[number] for number in sorted(parts))
+                        digests = b''.join(hashlib.md5(parts[number]).digest() for number in sorted(parts))
+                        standin.etags[query['objectKey']] = '%s-%d' % (hashlib.md5(digests).hexdigest(), len(parts))
+                    return self.send(200)
+                if url.path.startswith('/s3/') and query.get('list') == 'true':
+                    prefix = url.path[4:]
+                    listing = [{'key': key, 'size': len(data)} for key, data in sorted(standin.objects.items())
+                               if key.startswith(prefix)]
+                    return self.send(200, json.dumps(listing).encode())
+                if url.path.startswith('/s3/'):
+                    return self.send(307, headers={'Location': standin.base + '/obj/' + url.path[4:]})
+                if url.path.startswith('/obj/'):
+                    key = url.path[5:]
+                    if key not in standin.objects:
+                        return self.send(404)
+                    time.sleep(standin.latency)
+                    data = standin.objects[key]
+                    etag = '"%s"' % standin.object_etag(key, data)
+                    match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range') or '')
+                    with standin.lock:
+                        standin.gets.append((key, self.headers.get('Range')))
+                        start = int(match.group(1)) if match else 0
+                        fail = standin.fail_ranges.get(start) and self.headers.get('Range') != 'bytes=0-0'
+                        if fail:
+                            standin.fail_ranges[start] -= 1
+                    if fail:
+                        return self.send(503)
+                    if match and standin.ranges:
+                        start = int(match.group(1))
+                        if start >= len(data):
+                            return self.send(416, headers={'Content-Range': 'bytes */%d' % len(data)})
+                        end = int(match.group(2)) if match.group(2) else len(data) - 1
+                        return self.send(206, data[start:end + 1], {'ETag': etag,
+                                         'Content-Range': 'bytes %d-%d/%d' % (start, end, len(data))})
+                    return self.send(200, data, {'ETag': etag})
+                return self.send(404)
+
+            def do_PUT(self):
+                url = urlparse(self.path)
+                data = self.body()
+                if url.path.startswith('/part/'):
+                    time.sleep(standin.latency)
+                    uploadId, number = url.path[6:].split('/')
+                    number = int(number)
+                    with standin.lock:
+                        if number in standin.fail_parts:
+                            standin.fail_parts.discard(number)
+                            return self.send(503)
+                        standin.part_puts += 1
+                    contentMd5 = self.headers.get('Content-MD5')
+                    if contentMd5 and 'Signature=' in url.query and 'X-Amz-' not in url.query:
+                        #The header is not part of the signature of the url
+                        return self.send(403)
+                    if contentMd5 and base64.b64decode(contentMd5) != hashlib.md5(data).digest():
+                        return self.send(400)
+                    with standin.lock:
+                        standin.parts[uploadId][number] = data
+                    return self.send(200, headers={'ETag': standin.etag(data)})
+                if url.path.startswith('/s3/'):
+                    return self.send(307, headers={'Location': standin.base + '/obj/' + url.path[4:]})
+                if url.path.startswith('/obj/'):
+                    if url.path[5:] in standin.fail_keys:
+                        return self.send(500)
+                    standin.objects[url.path[5:]] = data
+                    standin.etags.pop(url.path[5:], None)
+                    return self.send(200, headers={'ETag': standin.etag(data)})
+                return self.send(404)
+
+            def do_DELETE(self):
+                url = urlparse(self.path)
+                self.body()
+                if url.path.startswith('/s3/'):
+                    return self.send(307, headers={'Location': standin.base + '/obj/' + url.path[4:]})
+                if url.path.startswith('/obj/'):
+                    #Like the S3, a missing key is not an error
+                    with standin.lock:
+                        standin.objects.pop(url.path[5:], None)
+                        standin.etags.pop(url.path[5:], None)
+                    return self.send(204)
+                return self.send(404)
+
+        return Handler
+
+
+@pytest.fixture
+def standin():
+    server = StandIn()
+    yield server
+    server.close()
+
+
+#maap_s3 talking to the stand-in, with its files in a temporary folder and short retries
+@pytest.fixture
+def s3(standin, tmp_path, monkeypatch):
+    monkeypatch.setattr(maap_s3, 'gateway_url', lambda path: standin.base + '/s3/' + path)
+    for name in ('USER_INFO_FILE_PATH', 'USER_LAST_UPLOAD_INFO_FILE_PATH', 'USER_LAST_DOWNLOAD_INFO_FILE_PATH',
+                 'SYNC_INFO_FILE_PATH', 'LIST_CACHE_FILE_PATH'):
+        monkeypatch.setattr(maap_s3, name, str(tmp_path / (name.lower() + '.json')))
+    monkeypatch.setattr(maap_s3, 'TRANSFER_LOG_FILE_PATH', '')
+    tokens = maap_s3.TokenManager()
+    tokens.set('user@esa.int', 'password', 'token', 4102444800)
+    monkeypatch.setattr(maap_s3, 'TOKENS', tokens)
+    monkeypatch.setattr(maap_s3, 'BANDWIDTH', maap_s3.BandwidthScheduler())
+    monkeypatch.setattr(maap_s3, 'RETRIES', maap_s3.RetryPolicy(attempts=1, base=0.01, cap=0.05))
+    #Parts of 1 MiB so a few MiB make a multipart upload
+    monkeypatch.setattr(maap_s3, 'S3_MIN_PART_SIZE', 1024 * 1024)
+    monkeypatch.setattr(maap_s3, 'MAAP_S3_MULTIPART_THRESHOLD', 2 * 1024 * 1024)
+    return maap_s3
@@ -0,0 +1,90 @@
+import asyncio
+import json
+import os
+import threading
+
+import pytest
+
+pytest.importorskip('aiohttp')
+
+
+def test_folder_download_with_more_files_than_requests(s3, standin, tmp_path):
+    for number in range(12):
+        standin.objects['folder/%02d.bin' % number] = os.urandom(1000 + number)
+
+    async def download():
+        async with s3.AsyncTransfer(requests=4, files=8) as transfer:
+            return await asyncio.wait_for(transfer.download('folder/', str(tmp_path)), 30)
+
+    assert asyncio.run(download()) == str(tmp_path)
+    for number in range(12):
+        assert (tmp_path / ('%02d.bin' % number)).read_bytes() == standin.objects['folder/%02d.bin' % number]
+
+
+def test_single_stream_download(s3, standin, tmp_path):
+    standin.objects['folder/data.bin'] = os.urandom(5000)
+    standin.ranges = False
+
+    async def download():
+        async with s3.AsyncTransfer(requests=1) as transfer:
+            return await asyncio.wait_for(transfer.download('folder/data.bin', str(tmp_path / 'data.bin')), 30)
+
+    asyncio.run(download())
+    assert (tmp_path / 'data.bin').read_bytes() == standin.objects['folder/data.bin']
+
+
+def test_both_backends_return_the_destination(s3, standin, tmp_path):
+    folder = tmp_path / 'folder'
+    folder.mkdir()
+    (folder / 'a.txt').write_bytes(b'a')
+    for backend in ('thread', 'asyncio'):
+        with s3.Client(backend=backend) as client:
+            assert client.upload(str(folder), 'dest') == 'dest'
+            assert client.upload(str(folder / 'a.txt'), 'dest/b.txt') == 'dest/b.txt'
+
+
+def test_both_backends_raise_folder_failures(s3, standin, tmp_path):
+    folder = tmp_path / 'folder'
+    folder.mkdir()
+    (folder / 'a.txt').write_bytes(b'a')
+    standin.fail_keys = {'dest/a.txt'}
+    for backend in ('thread', 'asyncio'):
+        with s3.Client(backend=backend) as client:
+            with pytest.raises(s3.MaapS3Error):
+                client.upload(str(folder), 'dest')
+
+
+def test_folder_upload_keeps_the_resume_journal(s3, standin, tmp_path):
+    #The journal of a single upload is not touched by a folder upload
+    with open(s3.USER_LAST_UPLOAD_INFO_FILE_PATH, 'w') as journal:
+        json.dump({'uploadId': 'previous'}, journal)
+    folder = tmp_path / 'folder'
+    folder.mkdir()
+    for name in ('a.bin', 'b.bin'):
+        (folder / name).write_bytes(os.urandom(3 * 1024 * 1024))
+    with s3.Client(backend='asyncio') as client:
+        client.upload(str(folder), 'dest')
+    for name in ('a.bin', 'b.bin'):
+        assert standin.objects['dest/' + name] == (folder / name).read_bytes()
+    with open(s3.USER_LAST_UPLOAD_INFO_FILE_PATH) as journal:
+        assert json.load(journal) == {'uploadId': 'previous'}
+
+
+def test_sync_calls_with_one_worker(s3, standin, tmp_path, monkeypatch):
+    #The loop of a sync call must not wait for the worker its own token fetch needs
+    monkeypatch.setattr(s3, 'MAAP_S3_WORKERS', 1)
+    sourceFile = tmp_path / 'data.bin'
+    sourceFile.write_bytes(b'data')
+    results = []
+    client = s3.Client(backend='asyncio')
+    threads = [threading.Thread(target=lambda key=key: results.append(client.upload(str(sourceFile), key)), daemon=True)
+               for key in ('dest/a.bin', 'dest/b.bin')]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(30)
+    #A stuck client can not be closed
+    assert not any(thread.is_alive() for thread in threads)
+    client.close()
+    assert sorted(results) == ['dest/a.bin', 'dest/b.bin']
+    assert standin.objects['dest/a.bin'] == b'data'
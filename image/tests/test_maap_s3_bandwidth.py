@@ -0,0 +1,132 @@
+import asyncio
+import io
+import os
+import threading
+import time
+
+import pytest
+
+MIB = 1024 * 1024
+
+
+#Send size bytes to the stand-in through the bucket and return the achieved rate
+def send(s3, standin, key, size, bucket):
+    reader = s3.ThrottledReader(io.BytesIO(os.urandom(size)), size, bucket)
+    start = time.time()
+    response = s3.get_client().put(standin.base + '/obj/' + key, data=reader)
+    response.raise_for_status()
+    return size / (time.time() - start)
+
+
+#Run the transfers (key, size, bucket) at once and return their rates
+def send_all(s3, standin, transfers):
+    rates = {}
+
+    def run(key, size, bucket):
+        rates[key] = send(s3, standin, key, size, bucket)
+    threads = [threading.Thread(target=run, args=transfer) for transfer in transfers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return rates
+
+
+def test_global_limit(s3, standin):
+    s3.BANDWIDTH.configure(rate=2 * MIB)
+    rates = send_all(s3, standin, [('a', 2 * MIB, s3.BANDWIDTH.register()), ('b', 2 * MIB, s3.BANDWIDTH.register())])
+    #The two transfers share the global rate
+    assert sum(rates.values()) == pytest.approx(2 * MIB, rel=0.2)
+    assert rates['a'] == pytest.approx(rates['b'], rel=0.2)
+
+
+def test_transfer_limit(s3, standin):
+    s3.BANDWIDTH.configure(transfer_rate=MIB)
+    rates = send_all(s3, standin, [('a', MIB, s3.BANDWIDTH.register()), ('b', MIB, s3.BANDWIDTH.register())])
+    for rate in rates.values():
+        assert rate == pytest.approx(MIB, rel=0.2)
+
+
+def test_priority_split(s3, standin):
+    s3.BANDWIDTH.configure(rate=2 * MIB)
+    #Priority 3 gets three quarters of the rate, so both transfers end together
+    rates = send_all(s3, standin, [('high', 3 * MIB // 2, s3.BANDWIDTH.register(3)), ('low', MIB // 2, s3.BANDWIDTH.register(1))])
+    assert rates['high'] == pytest.approx(1.5 * MIB, rel=0.2)
+    assert rates['low'] == pytest.approx(0.5 * MIB, rel=0.2)
+
+
+def test_upload_rate(s3, standin, tmp_path):
+    s3.BANDWIDTH.configure(rate=MIB)
+    sourceFile = tmp_path / 'data.bin'
+    sourceFile.write_bytes(os.urandom(3 * MIB // 2))
+    start = time.time()
+    s3.upload_file(str(sourceFile), 'folder/data.bin')
+    assert 1.5 * MIB / (time.time() - start) == pytest.approx(MIB, rel=0.2)
+    #The finished transfer no longer takes a share of the bandwidth
+    assert not s3.BANDWIDTH.buckets
+
+
+def test_failed_single_stream_download_unregisters(s3, standin, tmp_path):
+    standin.objects['folder/data.bin'] = b'data'
+    standin.ranges = False
+    with pytest.raises(IOError):
+        s3.download_path('folder/data.bin', str(tmp_path / 'missing' / 'data.bin'))
+    assert not s3.BANDWIDTH.buckets
+
+
+def test_failed_resume_completion_unregisters(s3, standin, tmp_path):
+    sourceFile = tmp_path / 'data.bin'
+    sourceFile.write_bytes(os.urandom(3 * MIB))
+    standin.complete_status = 500
+    with pytest.raises(Exception):
+        s3.upload_file(str(sourceFile), 'folder/data.bin')
+    with pytest.raises(Exception):
+        s3.resume()
+    assert not s3.BANDWIDTH.buckets
+
+
+def test_completion_connection_error_unregisters(s3, standin, tmp_path):
+    sourceFile = tmp_path / 'data.bin'
+    sourceFile.write_bytes(os.urandom(3 * MIB))
+    standin.complete_status = None
+    with pytest.raises(Exception):
+        s3.upload_file(str(sourceFile), 'folder/data.bin')
+    assert not s3.BANDWIDTH.buckets
+    with pytest.raises(Exception):
+        s3.resume()
+    assert not s3.BANDWIDTH.buckets
+    assert 'folder/data.bin' not in standin.objects
+
+
+def test_async_completion_connection_error_unregisters(s3, standin, tmp_path):
+    pytest.importorskip('aiohttp')
+    sourceFile = tmp_path / 'data.bin'
+    sourceFile.write_bytes(os.urandom(3 * MIB))
+    standin.complete_status = None
+
+    async def upload():
+        async with s3.AsyncTransfer(requests=2) as transfer:
+            await transfer.upload_file(str(sourceFile), 'folder/data.bin')
+
+    with pytest.raises(Exception):
+        asyncio.run(upload())
+    assert not s3.BANDWIDTH.buckets
+
+
+def test_async_unreadable_file_unregisters(s3, standin, tmp_path, monkeypatch):
+    pytest.importorskip('aiohttp')
+    sourceFile = tmp_path / 'data.bin'
+    sourceFile.write_bytes(b'data')
+
+    def map_file(sourceFile):
+        raise OSError('unreadable')
+
+    monkeypatch.setattr(s3, 'map_file', map_file)
+
+    async def upload():
+        async with s3.AsyncTransfer(requests=2) as transfer:
+            await transfer.upload_file(str(sourceFile), 'folder/data.bin')
+
+    with pytest.raises(OSError):
+        asyncio.run(upload())
+    assert not s3.BANDWIDTH.buckets
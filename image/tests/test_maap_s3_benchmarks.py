@@ -0,0 +1,24 @@
+#The benchmarks of benchmark_maap_s3.py on small sizes, checking what they are meant to show
+from benchmark_maap_s3 import MIB, download_throughput, handshakes, upload_throughput
+
+
+def test_parts_are_sent_in_parallel(s3, standin, tmp_path):
+    standin.latency = 0.1
+    rates = upload_throughput(s3, standin, str(tmp_path), 8 * MIB, workers=(1, 4))
+    assert rates[4] > 2 * rates[1]
+    assert standin.objects['bench/data.bin'] == (tmp_path / 'data.bin').read_bytes()
+
+
+def test_segments_are_fetched_in_parallel(s3, standin, tmp_path):
+    standin.latency = 0.1
+    rates = download_throughput(s3, standin, str(tmp_path), 8 * MIB, workers=(1, 4))
+    assert rates[4] > 2 * rates[1]
+    assert (tmp_path / 'download.bin').read_bytes() == standin.objects['bench/data.bin']
+
+
+def test_connections_are_reused(s3, standin, tmp_path):
+    counts = handshakes(s3, standin, str(tmp_path), 8 * MIB, workers=(4,))
+    connections, requests = counts[4]
+    #One pool of the workers plus the gateway calls
+    assert connections <= 4 + 2
+    assert requests > 3 * connections
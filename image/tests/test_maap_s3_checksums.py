@@ -0,0 +1,28 @@
+import os
+
+
+def upload(s3, tmp_path, size):
+    data = os.urandom(size)
+    sourceFile = tmp_path / 'data.bin'
+    sourceFile.write_bytes(data)
+    s3.upload_file(str(sourceFile), 'folder/data.bin')
+    return data
+
+
+def test_kms_etags_are_accepted(s3, standin, tmp_path):
+    standin.kms = True
+    for size in (3 * 1024 * 1024, 1024):
+        data = upload(s3, tmp_path, size)
+        assert standin.objects['folder/data.bin'] == data
+
+
+def test_no_content_md5_for_signature_v2_urls(s3, standin, tmp_path):
+    standin.signature = 'v2'
+    data = upload(s3, tmp_path, 3 * 1024 * 1024)
+    assert standin.objects['folder/data.bin'] == data
+
+
+def test_md5_headers(s3):
+    digest = b'\0' * 16
+    assert 'Content-MD5' in s3.md5_headers('https://s3/key?X-Amz-Expires=60&X-Amz-Signature=s', digest)
+    assert s3.md5_headers('https://s3/key?AWSAccessKeyId=a&Expires=1&Signature=s', digest) == {}
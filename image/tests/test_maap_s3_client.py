@@ -0,0 +1,20 @@
+import pytest
+
+
+def test_clients_share_one_account(s3, standin):
+    with s3.Client('user@esa.int', 'password'):
+        with pytest.raises(s3.MaapS3Error):
+            s3.Client('other@esa.int', 'password')
+    assert s3.TOKENS.email == 'user@esa.int'
+
+
+def test_last_client_closes_the_connections(s3, standin):
+    first = s3.Client()
+    second = s3.Client()
+    assert first.list('folder/') == []
+    http = s3.get_client()
+    first.close()
+    first.close()
+    assert s3.get_client() is http
+    second.close()
+    assert s3.get_client() is not http
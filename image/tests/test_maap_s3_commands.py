@@ -0,0 +1,23 @@
+def test_upload_dir_exit_code(s3, standin, tmp_path):
+    folder = tmp_path / 'folder'
+    folder.mkdir()
+    for name in ('a.txt', 'b.txt'):
+        (folder / name).write_bytes(name.encode())
+    assert s3.run_command(['upload-dir', str(folder), 'dest']) == 0
+    assert standin.objects['dest/a.txt'] == b'a.txt'
+
+    #One file failing makes the command fail, the other is still uploaded
+    standin.fail_keys = {'dest/b.txt'}
+    (folder / 'a.txt').write_bytes(b'new')
+    assert s3.run_command(['upload-dir', str(folder), 'dest']) == 1
+    assert standin.objects['dest/a.txt'] == b'new'
+
+
+def test_upload_dir_of_a_missing_folder_fails(s3, tmp_path):
+    assert s3.run_command(['upload-dir', str(tmp_path / 'missing'), 'dest']) == 1
+
+
+def test_help(s3, capsys):
+    for argv in (['-h'], ['--help'], ['help']):
+        assert s3.main(argv) == 0
+        assert 'Usage:' in capsys.readouterr().out
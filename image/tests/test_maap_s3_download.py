@@ -0,0 +1,71 @@
+import json
+import os
+
+import pytest
+
+MIB = 1024 * 1024
+
+
+def test_segmented_download(s3, standin, tmp_path):
+    data = os.urandom(5 * MIB + 3)
+    standin.objects['folder/data.bin'] = data
+    name = str(tmp_path / 'data.bin')
+    s3.download_file(standin.base + '/obj/folder/data.bin', name, segment_size=MIB, workers=4, journal=False)
+    with open(name, 'rb') as f:
+        assert f.read() == data
+    ranges = sorted(get[1] for get in standin.gets if get[1] != 'bytes=0-0')
+    assert ranges == sorted('bytes=%d-%d' % (start, min(start + MIB, len(data)) - 1) for start in range(0, len(data), MIB))
+
+
+def test_single_stream_without_ranges(s3, standin, tmp_path):
+    data = os.urandom(3 * MIB)
+    standin.objects['folder/data.bin'] = data
+    standin.ranges = False
+    name = str(tmp_path / 'data.bin')
+    s3.download_file(standin.base + '/obj/folder/data.bin', name, segment_size=MIB, journal=False)
+    with open(name, 'rb') as f:
+        assert f.read() == data
+    #The answer to the probe is the whole file
+    assert len(standin.gets) == 1
+
+
+def test_empty_object(s3, standin, tmp_path):
+    standin.objects['folder/empty.bin'] = b''
+    name = str(tmp_path / 'empty.bin')
+    s3.download_path('folder/empty.bin', name, journal=False)
+    assert os.path.getsize(name) == 0
+
+
+def interrupted_download(s3, standin, tmp_path):
+    #A multipart upload has a manifest, the download follows its parts of 1 MiB
+    sourceFile = tmp_path / 'source.bin'
+    sourceFile.write_bytes(os.urandom(5 * MIB))
+    s3.upload_file(str(sourceFile), 'folder/data.bin')
+    standin.fail_ranges = {2 * MIB: 1}
+    name = str(tmp_path / 'data.bin')
+    with pytest.raises(Exception):
+        s3.download_path('folder/data.bin', name)
+    return name
+
+
+def test_resume_download_fetches_the_missing_segments(s3, standin, tmp_path):
+    name = interrupted_download(s3, standin, tmp_path)
+    with open(s3.USER_LAST_DOWNLOAD_INFO_FILE_PATH) as journal:
+        completed = json.load(journal)['completedSegments']
+    assert [2 * MIB, 3 * MIB - 1] not in completed and len(completed) == 4
+
+    standin.gets = []
+    s3.resume_download()
+    with open(name, 'rb') as f:
+        assert f.read() == standin.objects['folder/data.bin']
+    assert [get[1] for get in standin.gets] == ['bytes=0-0', 'bytes=%d-%d' % (2 * MIB, 3 * MIB - 1)]
+    assert not os.path.isfile(s3.USER_LAST_DOWNLOAD_INFO_FILE_PATH)
+
+
+def test_resume_download_of_changed_data_starts_again(s3, standin, tmp_path):
+    name = interrupted_download(s3, standin, tmp_path)
+    standin.objects['folder/data.bin'] = data = os.urandom(4 * MIB)
+    standin.etags.pop('folder/data.bin')
+    s3.resume_download()
+    with open(name, 'rb') as f:
+        assert f.read() == data
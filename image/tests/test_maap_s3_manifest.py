@@ -0,0 +1,84 @@
+import json
+import os
+
+import pytest
+
+MIB = 1024 * 1024
+MANIFEST = 'folder/big.bin.maap-manifest.json'
+
+
+def upload(s3, tmp_path, name, size):
+    sourceFile = tmp_path / name
+    sourceFile.write_bytes(os.urandom(size))
+    s3.upload_file(str(sourceFile), 'folder/' + name)
+    return sourceFile.read_bytes()
+
+
+def test_only_multipart_uploads_have_a_manifest(s3, standin, tmp_path):
+    upload(s3, tmp_path, 'small.bin', 1000)
+    data = upload(s3, tmp_path, 'big.bin', 3 * MIB)
+    assert sorted(standin.objects) == ['folder/big.bin', MANIFEST, 'folder/small.bin']
+    manifest = json.loads(standin.objects[MANIFEST].decode())
+    assert manifest['size'] == len(data) and manifest['eTag'] == standin.etags['folder/big.bin']
+
+
+def test_manifest_fetched_for_multipart_objects_only(s3, standin, tmp_path):
+    upload(s3, tmp_path, 'small.bin', 1000)
+    upload(s3, tmp_path, 'big.bin', 3 * MIB)
+    s3.download_path('folder/small.bin', str(tmp_path / 'small.out'), journal=False)
+    assert [key for key, _ in standin.gets] == ['folder/small.bin'] * 2
+    standin.gets = []
+    s3.download_path('folder/big.bin', str(tmp_path / 'big.out'), journal=False)
+    assert MANIFEST in [key for key, _ in standin.gets]
+    assert (tmp_path / 'big.out').read_bytes() == standin.objects['folder/big.bin']
+
+
+def test_listing_hides_the_manifests(s3, standin, tmp_path):
+    upload(s3, tmp_path, 'big.bin', 3 * MIB)
+    assert [obj['key'] for obj in s3.iter_objects('folder/')] == ['folder/big.bin']
+    assert [obj['key'] for obj in s3.iter_objects('folder/', manifests=True)] == ['folder/big.bin', MANIFEST]
+
+
+def test_manifest_deleted_with_its_data(s3, standin, tmp_path):
+    upload(s3, tmp_path, 'big.bin', 3 * MIB)
+    s3.delete_object('folder/big.bin')
+    assert standin.objects == {}
+
+    upload(s3, tmp_path, 'big.bin', 3 * MIB)
+    assert s3.delete_many(prefix='folder/') == {}
+    assert standin.objects == {}
+
+    upload(s3, tmp_path, 'big.bin', 3 * MIB)
+    keysFile = tmp_path / 'keys.txt'
+    keysFile.write_text('folder/big.bin\n')
+    assert s3.delete_many(keysFile=str(keysFile)) == {}
+    assert standin.objects == {}
+
+
+def corrupt(standin):
+    #Same ETag, other bytes in the second part
+    data = bytearray(standin.objects['folder/big.bin'])
+    data[MIB + 10] ^= 0xff
+    standin.objects['folder/big.bin'] = bytes(data)
+
+
+def test_segments_checked_against_the_manifest(s3, standin, tmp_path):
+    upload(s3, tmp_path, 'big.bin', 3 * MIB)
+    corrupt(standin)
+    with pytest.raises(IOError, match='Checksum mismatch'):
+        s3.download_path('folder/big.bin', str(tmp_path / 'big.out'), journal=False)
+
+
+def test_single_stream_checked_against_the_manifest(s3, standin, tmp_path):
+    upload(s3, tmp_path, 'big.bin', 3 * MIB)
+    corrupt(standin)
+    standin.ranges = False
+    with pytest.raises(IOError, match='Checksum mismatch'):
+        s3.download_path('folder/big.bin', str(tmp_path / 'big.out'), journal=False)
+
+
+def test_manifest_of_other_data_is_ignored(s3, standin, tmp_path):
+    upload(s3, tmp_path, 'big.bin', 3 * MIB)
+    standin.etags['folder/big.bin'] = 'other-1'
+    s3.download_path('folder/big.bin', str(tmp_path / 'big.out'), journal=False)
+    assert (tmp_path / 'big.out').read_bytes() == standin.objects['folder/big.bin']
@@ -0,0 +1,91 @@
+import json
+import os
+
+import pytest
+
+
+def source_file(tmp_path, size):
+    data = os.urandom(size)
+    sourceFile = tmp_path / 'data.bin'
+    sourceFile.write_bytes(data)
+    return str(sourceFile), data
+
+
+def test_multipart_upload(s3, standin, tmp_path):
+    sourceFile, data = source_file(tmp_path, 5 * 1024 * 1024 + 7)
+    s3.upload_file(sourceFile, 'folder/data.bin')
+    assert standin.objects['folder/data.bin'] == data
+    assert not os.path.isfile(s3.USER_LAST_UPLOAD_INFO_FILE_PATH)
+
+
+def test_interrupted_upload_is_resumed(s3, standin, tmp_path):
+    sourceFile, data = source_file(tmp_path, 6 * 1024 * 1024 + 1)
+    standin.fail_parts = {2, 5}
+    with pytest.raises(Exception):
+        s3.upload_file(sourceFile, 'folder/data.bin')
+    assert 'folder/data.bin' not in standin.objects
+
+    with open(s3.USER_LAST_UPLOAD_INFO_FILE_PATH) as journal:
+        sent = [part['partNumber'] for part in json.load(journal)['partsUpploaded']]
+    assert 2 not in sent and 5 not in sent
+    puts = standin.part_puts
+
+    s3.resume()
+    assert standin.objects['folder/data.bin'] == data
+    #Only the parts missing from the journal are sent again
+    assert standin.part_puts - puts == 7 - len(sent)
+    assert not os.path.isfile(s3.USER_LAST_UPLOAD_INFO_FILE_PATH)
+
+
+def test_failed_completion_keeps_the_journal(s3, standin, tmp_path):
+    sourceFile, data = source_file(tmp_path, 3 * 1024 * 1024)
+    standin.complete_status = 500
+    with pytest.raises(Exception):
+        s3.upload_file(sourceFile, 'folder/data.bin')
+    assert 'folder/data.bin' not in standin.objects
+    assert os.path.isfile(s3.USER_LAST_UPLOAD_INFO_FILE_PATH)
+
+    standin.complete_status = 200
+    s3.resume()
+    assert standin.objects['folder/data.bin'] == data
+
+
+def interrupted_upload(s3, standin, tmp_path, size):
+    sourceFile, data = source_file(tmp_path, size)
+    standin.fail_parts = {2}
+    with pytest.raises(Exception):
+        s3.upload_file(sourceFile, 'folder/data.bin')
+    return sourceFile
+
+
+def test_changed_file_is_uploaded_again(s3, standin, tmp_path):
+    sourceFile = interrupted_upload(s3, standin, tmp_path, 4 * 1024 * 1024)
+    with open(s3.USER_LAST_UPLOAD_INFO_FILE_PATH) as journal:
+        multipartinfo = json.load(journal)
+    assert multipartinfo['fileSize'] == 4 * 1024 * 1024
+    assert multipartinfo['mtime'] == os.stat(sourceFile).st_mtime
+
+    #Same size, other content
+    data = os.urandom(4 * 1024 * 1024)
+    with open(sourceFile, 'wb') as f:
+        f.write(data)
+    os.utime(sourceFile, (multipartinfo['mtime'] + 10, multipartinfo['mtime'] + 10))
+    s3.resume()
+    assert standin.objects['folder/data.bin'] == data
+    assert not os.path.isfile(s3.USER_LAST_UPLOAD_INFO_FILE_PATH)
+
+
+def test_shrunk_file_of_an_old_journal_is_uploaded_again(s3, standin, tmp_path):
+    sourceFile = interrupted_upload(s3, standin, tmp_path, 6 * 1024 * 1024)
+    #Journals of older versions have neither the size nor the date of the file
+    with open(s3.USER_LAST_UPLOAD_INFO_FILE_PATH) as journal:
+        multipartinfo = json.load(journal)
+    del multipartinfo['fileSize'], multipartinfo['mtime']
+    with open(s3.USER_LAST_UPLOAD_INFO_FILE_PATH, 'w') as journal:
+        json.dump(multipartinfo, journal)
+
+    data = os.urandom(3 * 1024 * 1024 + 5)
+    with open(sourceFile, 'wb') as f:
+        f.write(data)
+    s3.resume()
+    assert standin.objects['folder/data.bin'] == data
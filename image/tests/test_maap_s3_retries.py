@@ -0,0 +1,26 @@
+import os
+
+import pytest
+
+
+def test_segment_status_is_retried_once_per_attempt(s3, standin, tmp_path, monkeypatch):
+    data = os.urandom(3 * 1024 * 1024)
+    standin.objects['folder/data.bin'] = data
+    name = str(tmp_path / 'data.bin')
+    #The 503 is left to RetryPolicy, the HTTP adapter does not send the request again
+    standin.fail_ranges = {0: 1}
+    with pytest.raises(Exception):
+        s3.download_path('folder/data.bin', name, journal=False)
+    assert [get for get in standin.gets if get[0] == 'folder/data.bin'] == [
+        ('folder/data.bin', 'bytes=0-0'), ('folder/data.bin', 'bytes=0-%d' % (len(data) - 1))]
+
+    standin.fail_ranges = {0: 1}
+    monkeypatch.setattr(s3, 'RETRIES', s3.RetryPolicy(attempts=2, base=0.01, cap=0.05))
+    s3.download_path('folder/data.bin', name, journal=False)
+    with open(name, 'rb') as f:
+        assert f.read() == data
+
+
+def test_http_adapter_retries_connections_only(s3):
+    retry = s3.HttpClient().adapter.max_retries
+    assert retry.status == 0 and retry.read == 0 and not retry.status_forcelist
@@ -0,0 +1,19 @@
+def test_presigned_url_windows_double(s3, standin):
+    presignedUrls = s3.PresignedUrlProvider('folder/data.bin', 'upload-1', 1000, window=100)
+    for partNumber in range(1, 1001):
+        assert presignedUrls.get(partNumber).startswith(standin.base + '/part/upload-1/' + str(partNumber) + '?')
+    #Each call signs the parts 1 to nbParts, the windows grow so the total stays near the number of parts
+    assert standin.url_requests == sorted(standin.url_requests)
+    assert standin.url_requests[-1] == 1000
+    assert sum(standin.url_requests) <= 3 * 1000
+
+
+def test_expired_url_is_fetched_again(s3, standin):
+    presignedUrls = s3.PresignedUrlProvider('folder/data.bin', 'upload-1', 10, window=4)
+    presignedUrls.get(1)
+    calls = len(standin.url_requests)
+    presignedUrls.get(2)
+    assert len(standin.url_requests) == calls
+    presignedUrls.expire(2)
+    presignedUrls.get(2)
+    assert len(standin.url_requests) == calls + 1